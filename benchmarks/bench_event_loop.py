@@ -0,0 +1,71 @@
+"""
+Compare the startup time and the dispatch throughput of the event loops.
+
+startup: the median seconds of a fresh interpreter that imports the library or the cli
+dispatch: requests sent per second by a provider without rate limit and with a no-op send
+
+usage: python -m benchmarks.bench_event_loop [requests] [providers]
+"""
+import asyncio
+import statistics
+import subprocess
+import sys
+import time
+
+from request_manager import Controller, Provider, Response, StatusCode
+from request_manager.loop import LOOPS, loop_factory, run
+
+
+class NoopProvider(Provider):
+    async def send_request(self, request) -> Response:
+        self.last_request_time = time.time()
+        return Response(status_code=StatusCode.SUCCESS, data={})
+
+
+def startup_time(statement: str, repeat: int = 5) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], check=True)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+async def dispatch(count: int, provider_count: int) -> float:
+    providers = [NoopProvider(f"P{i}", rate_limit=1e9) for i in range(provider_count)]
+    controller = Controller(providers)
+    for i in range(count):
+        controller.new_request_received(providers[i % provider_count], priority=i % 10)
+    start = time.perf_counter()
+    controller.start()
+    await controller.wait_for_complete()
+    elapsed = time.perf_counter() - start
+    controller.stop()
+    return count / elapsed
+
+
+def main(count: int, provider_count: int) -> None:
+    for name, statement in (
+        ("python", "pass"),
+        ("library", "import request_manager"),
+        ("cli", "import request_manager.cli"),
+    ):
+        print(f"{'startup ' + name:>16}: {startup_time(statement) * 1000:8.1f} ms")
+    for name in LOOPS:
+        try:
+            loop_factory(name)
+        except ImportError as e:
+            print(f"{name:>16}: skipped, {e}")
+            continue
+        rate = run(dispatch(count, provider_count), loop=name)
+        print(
+            f"{name:>16}: {rate:12,.0f} requests/s ({provider_count} providers x"
+            f" {count // provider_count})"
+        )
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 50_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 4,
+    )
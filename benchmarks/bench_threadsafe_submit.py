@@ -0,0 +1,72 @@
+"""
+Compare the throughput of submitting requests from other threads.
+
+per-item: every request is handed to the loop by its own `call_soon_threadsafe`
+batched: `Controller.submit_threadsafe`, the loop drains a shared buffer in chunks
+batched-many: `Controller.submit_many_threadsafe` with 100 requests per future
+
+usage: python -m benchmarks.bench_threadsafe_submit [requests per thread] [threads]
+"""
+import asyncio
+import sys
+import threading
+import time
+
+from request_manager import Controller, Provider
+
+
+def per_item(controller: Controller, provider: Provider, count: int) -> None:
+    for _ in range(count):
+        controller.loop.call_soon_threadsafe(controller.new_request_received, provider)
+
+
+def batched(controller: Controller, provider: Provider, count: int) -> None:
+    for _ in range(count):
+        controller.submit_threadsafe(provider)
+
+
+def batched_many(controller: Controller, provider: Provider, count: int) -> None:
+    for _ in range(count // 100):
+        controller.submit_many_threadsafe([{"provider": provider}] * 100)
+
+
+async def measure(submit, count: int, thread_count: int) -> float:
+    provider = Provider("P", 1)
+    # keep the requests in the queue, only the submission is measured
+    provider.stop()
+    controller = Controller([provider])
+    controller.start()
+    threads = [
+        threading.Thread(target=submit, args=(controller, provider, count))
+        for _ in range(thread_count)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    total = count * thread_count
+    while provider.queue.qsize() < total:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    for thread in threads:
+        thread.join()
+    controller.stop()
+    return total / elapsed
+
+
+async def main(count: int, thread_count: int) -> None:
+    for name, submit in (
+        ("per-item", per_item),
+        ("batched", batched),
+        ("batched-many", batched_many),
+    ):
+        rate = await measure(submit, count, thread_count)
+        print(f"{name:>12}: {rate:12,.0f} requests/s ({thread_count} threads x {count})")
+
+
+if __name__ == "__main__":
+    asyncio.run(
+        main(
+            int(sys.argv[1]) if len(sys.argv) > 1 else 50_000,
+            int(sys.argv[2]) if len(sys.argv) > 2 else 4,
+        )
+    )
@@ -1,6 +1,17 @@
 from .integration.adaptor import StatusCode, Provider, JobRequest, Response
-from .integration.utils import CLIActions
+from .integration.limiter import (
+    DistributedRateLimiter,
+    MemoryBackend,
+    FileBackend,
+    ServerBackend,
+    RateLimitServer,
+)
+from .integration.recurrence import RecurringRequest, IntervalSchedule, CronSchedule
+from .integration.payload import PayloadArena, PayloadRef, payload_view
+from .integration.registry import RequestRegistry
+from .integration.utils import CLIActions, MissedRunPolicy
 from .controller import Controller
+from .loop import loop_factory, run
 
 __all__ = [
     "Controller",
@@ -9,4 +20,19 @@ __all__ = [
     "StatusCode",
     "Response",
     "CLIActions",
+    "DistributedRateLimiter",
+    "MemoryBackend",
+    "FileBackend",
+    "ServerBackend",
+    "RateLimitServer",
+    "RecurringRequest",
+    "IntervalSchedule",
+    "CronSchedule",
+    "MissedRunPolicy",
+    "RequestRegistry",
+    "PayloadArena",
+    "PayloadRef",
+    "payload_view",
+    "loop_factory",
+    "run",
 ]
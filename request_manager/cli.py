@@ -1,13 +1,46 @@
 import asyncio
 import logging
+import os
 import random
 
 import questionary
 
 from .controller import Controller
 from .integration import Provider
+from .integration.stats import Monitor, format_stats
 from .integration.utils import CLIActions
 from .log import logger
+from .loop import run
+
+# seconds that exit waits for the due requests to be sent
+DRAIN_TIMEOUT = 10
+# the requests that have not been sent on exit are saved here
+JOURNAL_PATH = os.environ.get("RMCLI_JOURNAL", "rmcli_journal.jsonl")
+# seconds between two refreshes of the live monitor
+MONITOR_INTERVAL = 1
+CLEAR_SCREEN = "\x1b[H\x1b[2J"
+
+
+# the choice of dropping the requests of a removed provider, it can't collide with a provider name
+DROP_REQUESTS = object()
+
+
+def validate_rate_limit(text: str) -> bool | str:
+    try:
+        rate_limit = float(text)
+    except ValueError:
+        return "rate limit must be a number"
+    if rate_limit <= 0:
+        return "rate limit must be positive"
+    return True
+
+
+def validate_integer(text: str) -> bool | str:
+    try:
+        int(text)
+    except ValueError:
+        return "put an integer"
+    return True
 
 
 class Command:
@@ -20,9 +53,10 @@ class Command:
 
 class ExitCommand(Command):
     async def execute(self):
-        """stop controller and exit from cli"""
-        self.controller.stop()
-        exit(0)
+        """send the due requests, stop controller and exit from cli"""
+        remaining = await self.controller.drain(timeout=DRAIN_TIMEOUT, journal_path=JOURNAL_PATH)
+        if remaining:
+            questionary.print(f"{len(remaining)} requests have not been sent, saved in {JOURNAL_PATH}")
 
 
 class EnableProviderCommand(Command):
@@ -130,14 +164,12 @@ class WizardCommand(Command):
         )
         logger.info("starting")
         if create_provider:
-            for i, rate in zip(
-                range(
-                    len(self.controller.providers),
-                    len(self.controller.providers) + provider_count,
-                ),
-                provider_rates,
-            ):
-                self.controller.add_provider(Provider(f"P{i}", rate))
+            index = len(self.controller.providers)
+            for rate in provider_rates:
+                # a removed provider may have left a gap in the names
+                while f"P{index}" in self.controller.providers:
+                    index += 1
+                self.controller.add_provider(Provider(f"P{index}", rate))
 
         self.controller.start()
         for _ in range(request_count):
@@ -200,19 +232,158 @@ class AddProviderCommand(Command):
 
         rate_limit = float(
             await questionary.text(
-                "put your provider rate-limit request/second", default="10.0"
+                "put your provider rate-limit request/second",
+                default="10.0",
+                validate=validate_rate_limit,
             ).ask_async()
         )
-        self.controller.add_provider(Provider(provider_name, rate_limit))
+        try:
+            self.controller.add_provider(Provider(provider_name, rate_limit))
+        except ValueError as e:
+            questionary.print(str(e))
+            return
         questionary.print("Provider added successfully")
 
 
+class InspectRequestCommand(Command):
+    async def execute(self):
+        """show a queued request by its name, then cancel it or change its priority or time"""
+        name = await questionary.text("put name of request").ask_async()
+        requests = self.controller.find_requests(name)
+        if not requests:
+            questionary.print(f"No queued request is named {name}")
+            return
+        request = requests[0]
+        if len(requests) > 1:
+            request = await questionary.select(
+                "Which request?",
+                choices=[questionary.Choice(repr(request), value=request) for request in requests],
+            ).ask_async()
+        questionary.print(repr(request))
+        action = await questionary.select(
+            "What do you want to do?",
+            choices=["Cancel", "Change priority", "Change execution time", "Nothing"],
+        ).ask_async()
+        try:
+            if action == "Cancel":
+                self.controller.cancel_request(request)
+                questionary.print("Request cancelled")
+            elif action == "Change priority":
+                priority = int(
+                    await questionary.text(
+                        "Put your priority",
+                        default=str(request.priority * -1),
+                        validate=validate_integer,
+                    ).ask_async()
+                )
+                questionary.print(repr(self.controller.reprioritize_request(request, priority)))
+            elif action == "Change execution time":
+                execution_time = int(
+                    await questionary.text(
+                        "Put your execution time in seconds",
+                        default="0",
+                        validate=validate_integer,
+                    ).ask_async()
+                )
+                questionary.print(
+                    repr(self.controller.reschedule_request(request, execution_time))
+                )
+        except KeyError:
+            # it has been sent while the user was answering
+            questionary.print("The request is not queued anymore")
+
+
+class RestoreRequestsCommand(Command):
+    async def execute(self):
+        """submit again the requests that have been saved on exit"""
+        if not os.path.exists(JOURNAL_PATH):
+            questionary.print(f"No saved request in {JOURNAL_PATH}")
+            return
+        try:
+            requests = self.controller.restore_journal(JOURNAL_PATH)
+        except KeyError as e:
+            questionary.print(f"Add provider {e} before restoring its requests")
+            return
+        os.remove(JOURNAL_PATH)
+        questionary.print(f"{len(requests)} requests restored")
+
+
+class RemoveProviderCommand(Command):
+    async def execute(self):
+        """remove a provider and move its queued requests to another provider"""
+        providers = [provider.name for provider in self.controller.providers]
+        if not providers:
+            questionary.print("No provider is available to remove")
+            return
+        selected_provider_name = await questionary.select(
+            "Which provider do you want to remove?", choices=providers
+        ).ask_async()
+        targets = [name for name in providers if name != selected_provider_name]
+        migrate_to = None
+        if targets:
+            migrate_to = await questionary.select(
+                "Which provider takes its queued requests?",
+                choices=targets + [questionary.Choice("Drop requests", value=DROP_REQUESTS)],
+            ).ask_async()
+            if migrate_to is DROP_REQUESTS:
+                migrate_to = None
+        requests = await self.controller.remove_provider(selected_provider_name, migrate_to)
+        if migrate_to is None:
+            questionary.print(f"Provider removed, {len(requests)} queued requests dropped")
+        else:
+            questionary.print(f"Provider removed, {len(requests)} requests moved to {migrate_to}")
+
+
+class SetRateLimitCommand(Command):
+    async def execute(self):
+        """change the rate limit of a provider while it is running"""
+        providers = [provider.name for provider in self.controller.providers]
+        if not providers:
+            questionary.print("No provider is available to change")
+            return
+        selected_provider_name = await questionary.select(
+            "Which provider do you want to change?", choices=providers
+        ).ask_async()
+        provider = self.controller.providers[selected_provider_name]
+        rate_limit = float(
+            await questionary.text(
+                "put your provider rate-limit request/second",
+                default=str(provider.rate_limit),
+                validate=validate_rate_limit,
+            ).ask_async()
+        )
+        self.controller.set_rate_limit(provider, rate_limit)
+        questionary.print("Rate limit changed successfully")
+
+
+class MonitorCommand(Command):
+    async def execute(self):
+        """show a top-style view of the providers until enter is pressed"""
+        monitor = Monitor()
+        stopped = asyncio.ensure_future(asyncio.to_thread(input))
+        # the log lines of the sent requests would scroll the view away
+        level = logger.level
+        logger.setLevel(logging.WARNING)
+        try:
+            while not stopped.done():
+                print(CLEAR_SCREEN + format_stats(monitor.sample(self.controller.providers)))
+                print("\npress enter to go back")
+                await asyncio.wait([stopped], timeout=MONITOR_INTERVAL)
+        finally:
+            logger.setLevel(level)
+
+
 class CLI:
     controller = Controller()
     command_mapping = {
         CLIActions.WIZARD: WizardCommand(controller),
         CLIActions.ADD_REQUEST: AddRequestCommand(controller),
+        CLIActions.RESTORE_REQUESTS: RestoreRequestsCommand(controller),
+        CLIActions.INSPECT_REQUEST: InspectRequestCommand(controller),
+        CLIActions.MONITOR: MonitorCommand(controller),
         CLIActions.ADD_PROVIDER: AddProviderCommand(controller),
+        CLIActions.REMOVE_PROVIDER: RemoveProviderCommand(controller),
+        CLIActions.SET_RATE_LIMIT: SetRateLimitCommand(controller),
         CLIActions.RUN: RunCommand(controller),
         CLIActions.STOP: StopCommand(controller),
         CLIActions.ENABLE_PROVIDER: EnableProviderCommand(controller),
@@ -243,11 +414,13 @@ class CLI:
             if selected_action in self.command_mapping:
                 command = self.command_mapping[selected_action]
                 await command.execute()
+            if selected_action == CLIActions.EXIT:
+                return
 
 
 def main():
     logger.setLevel(logging.INFO)
-    asyncio.run(CLI().run())
+    run(CLI().run())
 
 
 if __name__ == "__main__":
@@ -1,10 +1,19 @@
 import asyncio
+import collections
+import concurrent.futures
 import datetime
+import os
+import time
 from asyncio import Task
 
 from .integration import Provider, JobRequest
+from .integration.recurrence import CronSchedule, IntervalSchedule, RecurringRequest
+from .integration.utils import MissedRunPolicy
 from .integration.abc import ProviderABC
+from .integration.payload import Payload, PayloadRef
 from .integration.adaptor import ProviderContainer
+from .integration.registry import RequestRegistry
+from .journal import read_journal, write_journal
 from .log import logger
 
 
@@ -12,6 +21,8 @@ class Controller:
     tasks: list[Task]
     providers = dict[str, ProviderABC]
     request_counter = 0
+    # the most requests that are taken from the thread handoff buffer in one loop callback
+    handoff_chunk_size = 1024
 
     def __init__(self, providers: list[ProviderABC] | None = None):
         """
@@ -21,10 +32,98 @@ class Controller:
             providers (list[Provider]): A list of Provider objects to manage.
         """
         self.providers = ProviderContainer(provider_list=providers)
+        self.registry = RequestRegistry()
+        for provider in self.providers:
+            provider.registry = self.registry
         self.tasks = []
+        self.provider_tasks: dict[str, Task] = {}
+        self.running = False
+        self.accepting = True
+        self.recurring_requests: list[RecurringRequest] = []
+        self.loop: asyncio.AbstractEventLoop | None = None
+        # requests submitted by other threads, drained by the loop in chunks
+        self._handoff = collections.deque()
+        self._handoff_scheduled = False
 
     def add_provider(self, provider: ProviderABC):
+        """
+        Add a provider, it starts to send requests right away if the controller is running.
+        """
+        if provider.name in self.providers:
+            raise ValueError(f"provider {provider.name} already exists")
+        # a provider that has been removed can be added again
+        provider.closed = False
+        provider.registry = self.registry
         self.providers[provider.name] = provider
+        if self.running:
+            self._start_provider(provider)
+
+    async def remove_provider(
+        self, provider: ProviderABC | str, migrate_to: ProviderABC | str | None = None
+    ) -> list[JobRequest]:
+        """
+        Remove a provider without interrupting the other providers.
+
+        The provider finishes its in-flight request, then the requests left in its
+        queues are moved to `migrate_to`.
+
+        Args:
+            provider (Provider | str): The provider or the name of the provider to remove.
+            migrate_to (Provider | str, optional): The provider that takes the queued requests.
+                Defaults to None, which means the requests are only returned.
+
+        Returns:
+            list[JobRequest]: The requests that were queued in the removed provider.
+        """
+        provider = self.providers[provider]
+        target = self.providers[migrate_to] if migrate_to is not None else None
+        if target is provider:
+            raise ValueError(f"can not migrate requests of {provider.name} to itself")
+        del self.providers[provider]
+        await self._stop_provider(provider)
+        requests = provider.drain_requests()
+        if target is not None:
+            self.migrate_requests(requests, target)
+        else:
+            for request in requests:
+                if request.recurrence is not None:
+                    # the occurrences of the definition are dropped with the provider
+                    request.recurrence.cancel()
+        logger.info(f"removed provider[{provider.name}] with {len(requests)} queued requests")
+        return requests
+
+    def migrate_requests(self, requests: list[JobRequest], provider: ProviderABC) -> None:
+        """
+        Move the requests to the queue of `provider`.
+        """
+        for request in requests:
+            request.provider = provider
+            if request.recurrence is not None:
+                request.recurrence.provider = provider
+            provider.add_request(request)
+        logger.info(f"migrated {len(requests)} requests to provider[{provider.name}]")
+
+    def set_rate_limit(self, provider: ProviderABC | str, rate_limit: float) -> None:
+        """
+        Change the rate limit of a provider while it is running.
+        """
+        self.providers[provider].set_rate_limit(rate_limit)
+
+    def set_tenant_weight(
+        self, provider: ProviderABC | str, tenant: str | None, weight: float
+    ) -> None:
+        """
+        Change the share of a tenant in the dispatches of a provider with fair queueing.
+        """
+        self.providers[provider].set_tenant_weight(tenant, weight)
+
+    def set_tenant_quota(
+        self, provider: ProviderABC | str, tenant: str | None, quota: int | None
+    ) -> None:
+        """
+        Limit the number of queued requests of a tenant in a provider, None removes the limit.
+        """
+        self.providers[provider].set_tenant_quota(tenant, quota)
 
     def new_request_received(
         self,
@@ -32,6 +131,9 @@ class Controller:
         priority: int = 10,
         execution_after: datetime.datetime | int = 0,
         request_name: str | None = None,
+        expires_after: datetime.datetime | int | None = None,
+        tenant: str | None = None,
+        payload: Payload | None = None,
     ) -> JobRequest:
         """
          Create a new job request and add it to the provider's queue.
@@ -43,29 +145,322 @@ class Controller:
                 It can be either a datetime object or an integer representing seconds from the current time.
                 Defaults to 0, which means immediate execution.
             request_name (str, optional): A name or identifier for the job request. Defaults to an empty string.
+            expires_after (datetime.datetime | int, optional): The deadline of sending the request,
+                a datetime object or seconds from the current time. Defaults to None, which
+                means it never expires.
+            tenant (str, optional): The tenant that owns the request. Defaults to None.
+            payload (bytes | memoryview | PayloadRef, optional): The body of the request, it is
+                not copied. Defaults to None.
 
         Returns:
             JobRequest: The created JobRequest object.
+
+        Raises:
+            asyncio.QueueFull: If the tenant has reached its quota in the provider.
         """
         request = JobRequest(
             name=request_name if request_name else f"{self.request_counter}",
             provider=provider,
             priority=priority,
             execution_after=execution_after,
+            expires_after=expires_after,
+            tenant=tenant,
+            payload=payload,
+        )
+        if not self.accepting:
+            raise RuntimeError("controller is draining and does not accept new requests")
+        if provider.closed:
+            raise ValueError(f"provider {provider.name} has been removed")
+        provider.check_tenant_quota(tenant)
+        provider.add_request(request)
+        logger.info("added %s", request)
+        self.request_counter += 1
+        return request
+
+    def new_recurring_request(
+        self,
+        provider: Provider,
+        priority: int = 10,
+        interval: float | None = None,
+        cron: str | None = None,
+        start_after: int = 0,
+        request_name: str | None = None,
+        missed_runs: MissedRunPolicy = MissedRunPolicy.SKIP,
+    ) -> RecurringRequest:
+        """
+        Create a request that repeats on a fixed interval or a cron expression.
+
+        Only the next occurrence is added to the provider's queue, the provider
+        adds the one after it when the current occurrence has been sent.
+
+        Args:
+            provider (Provider): The provider of the occurrences.
+            priority (int): The priority of the occurrences.
+            interval (float, optional): The seconds between two occurrences.
+            cron (str, optional): A 5 fields cron expression, used instead of `interval`.
+            start_after (int, optional): The seconds from now before the first occurrence.
+            request_name (str, optional): The name of the definition, occurrences are named `name#n`.
+            missed_runs (MissedRunPolicy, optional): Catch up or skip the occurrences that
+                have been missed. Defaults to skip.
+
+        Returns:
+            RecurringRequest: The definition, call its `cancel` to stop the occurrences.
+        """
+        if (interval is None) == (cron is None):
+            raise ValueError("exactly one of interval and cron must be given")
+        if not self.accepting:
+            raise RuntimeError("controller is draining and does not accept new requests")
+        if provider.closed:
+            raise ValueError(f"provider {provider.name} has been removed")
+        start_time = time.time() + start_after
+        schedule = (
+            IntervalSchedule(interval, start_time) if cron is None else CronSchedule(cron)
         )
-        provider.queue.put_nowait((request.priority, request))
-        logger.info(f"added {request}")
+        recurring_request = RecurringRequest(
+            schedule=schedule,
+            provider=provider,
+            priority=priority,
+            name=request_name if request_name else f"{self.request_counter}",
+            missed_runs=missed_runs,
+        )
+        request = recurring_request.first_request(start_time)
+        provider.add_request(request)
+        self.recurring_requests.append(recurring_request)
+        logger.info(f"added recurring {request}")
         self.request_counter += 1
+        return recurring_request
+
+    def get_request(self, request_id: int) -> JobRequest | None:
+        """
+        Return the queued request with `request_id`, None if it is not queued.
+        """
+        return self.registry.get(request_id)
+
+    def find_requests(self, name: str) -> list[JobRequest]:
+        """
+        Return the queued requests that are named `name`.
+        """
+        return self.registry.find(name)
+
+    def _queued_request(self, request: JobRequest | int) -> JobRequest:
+        request_id = request if isinstance(request, int) else request.id
+        queued_request = self.registry.get(request_id)
+        if queued_request is None:
+            raise KeyError(f"request {request_id} is not queued, it is sent or in-flight")
+        return queued_request
+
+    def cancel_request(self, request: JobRequest | int) -> JobRequest:
+        """
+        Cancel a queued request, it is skipped when its provider takes it from the queue.
+
+        Raises KeyError if the request is not queued anymore.
+
+        Returns:
+            JobRequest: The cancelled request.
+        """
+        request = self._queued_request(request)
+        request.provider.drop_request(request)
+        logger.info("cancelled %s", request)
         return request
 
+    def reprioritize_request(self, request: JobRequest | int, priority: int) -> JobRequest:
+        """
+        Change the priority of a queued request in O(log n).
+
+        The queued item is dropped and a copy with the same id is queued instead.
+        Raises KeyError if the request is not queued anymore.
+
+        Returns:
+            JobRequest: The copy that replaces the request.
+        """
+        request = self._queued_request(request)
+        new_request = request.copy()
+        new_request.priority = priority * -1
+        self._replace_request(request, new_request)
+        return new_request
+
+    def reschedule_request(
+        self, request: JobRequest | int, execution_after: datetime.datetime | int
+    ) -> JobRequest:
+        """
+        Change the execution time of a queued request in O(log n).
+
+        Raises KeyError if the request is not queued anymore.
+
+        Returns:
+            JobRequest: The copy that replaces the request.
+        """
+        request = self._queued_request(request)
+        new_request = request.copy()
+        if isinstance(execution_after, datetime.datetime):
+            new_request.execution_time = execution_after.timestamp()
+        else:
+            new_request.execution_time = time.time() + execution_after
+        self._replace_request(request, new_request)
+        return new_request
+
+    @staticmethod
+    def _replace_request(request: JobRequest, new_request: JobRequest) -> None:
+        provider = request.provider
+        provider.drop_request(request)
+        provider.add_request(new_request)
+        if request.recurrence is not None and request.recurrence.next_execution_time == (
+            request.execution_time
+        ):
+            request.recurrence.next_execution_time = new_request.execution_time
+        logger.info("replaced %s with %s", request, new_request)
+
+    def submit_threadsafe(
+        self,
+        provider: Provider | str,
+        priority: int = 10,
+        execution_after: datetime.datetime | int = 0,
+        request_name: str | None = None,
+        expires_after: datetime.datetime | int | None = None,
+    ) -> concurrent.futures.Future[JobRequest]:
+        """
+        Submit a request from any thread, the arguments are the same as `new_request_received`.
+
+        The request is put in a buffer that the loop of the controller drains in chunks,
+        so the loop is woken up once per batch of requests instead of once per request.
+
+        Returns:
+            concurrent.futures.Future[JobRequest]: Resolved with the created request, or with
+                the error of `new_request_received`.
+        """
+        return self._handoff_put(
+            [(provider, priority, execution_after, request_name, expires_after)], single=True
+        )
+
+    def submit_many_threadsafe(self, requests: list[dict]) -> concurrent.futures.Future:
+        """
+        Submit a batch of requests from any thread with a single future.
+
+        Args:
+            requests (list[dict]): The keyword arguments of `submit_threadsafe` for each request.
+
+        Returns:
+            concurrent.futures.Future[list[JobRequest]]: Resolved with the created requests,
+                or with the first error, the requests before the error are queued.
+        """
+        return self._handoff_put(
+            [
+                (
+                    request["provider"],
+                    request.get("priority", 10),
+                    request.get("execution_after", 0),
+                    request.get("request_name"),
+                    request.get("expires_after"),
+                )
+                for request in requests
+            ],
+            single=False,
+        )
+
+    def _handoff_put(self, arguments: list[tuple], single: bool) -> concurrent.futures.Future:
+        if self.loop is None:
+            raise RuntimeError("controller must be started before submitting from threads")
+        future = concurrent.futures.Future()
+        self._handoff.append((future, arguments, single))
+        # deque.append is atomic, so no lock is taken. a stale flag may schedule an extra
+        # drain, which finds the buffer empty, but it can't leave a request in the buffer
+        if not self._handoff_scheduled:
+            self._handoff_scheduled = True
+            self.loop.call_soon_threadsafe(self._drain_handoff)
+        return future
+
+    def submit_blocking(
+        self,
+        provider: Provider | str,
+        priority: int = 10,
+        execution_after: datetime.datetime | int = 0,
+        request_name: str | None = None,
+        expires_after: datetime.datetime | int | None = None,
+        timeout: float | None = None,
+    ) -> JobRequest:
+        """
+        Submit a request from a thread other than the loop's and wait until it has been queued.
+
+        Returns:
+            JobRequest: The created JobRequest object.
+        """
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is not None and running_loop is self.loop:
+            raise RuntimeError("submit_blocking would block the loop, use new_request_received")
+        future = self.submit_threadsafe(
+            provider, priority, execution_after, request_name, expires_after
+        )
+        return future.result(timeout)
+
+    def _drain_handoff(self) -> None:
+        """
+        Queue a chunk of the requests that have been submitted by other threads.
+        """
+        for _ in range(min(self.handoff_chunk_size, len(self._handoff))):
+            future, arguments, single = self._handoff.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            requests = []
+            try:
+                for provider, priority, execution_after, request_name, expires_after in arguments:
+                    requests.append(
+                        self.new_request_received(
+                            provider=(
+                                self.providers[provider] if isinstance(provider, str) else provider
+                            ),
+                            priority=priority,
+                            execution_after=execution_after,
+                            request_name=request_name,
+                            expires_after=expires_after,
+                        )
+                    )
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(requests[0] if single else requests)
+        self._handoff_scheduled = False
+        # a thread may have appended after the chunk was taken and seen the flag still set
+        if self._handoff:
+            self._handoff_scheduled = True
+            # let the providers run before the next chunk
+            self.loop.call_soon(self._drain_handoff)
+
     def start(self):
         """
         Start the providers' tasks.
         This method creates tasks for each provider to run concurrently
         """
-        self.tasks = [
-            asyncio.create_task(provider.run()) for provider in self.providers
-        ]
+        self.running = True
+        self.loop = asyncio.get_running_loop()
+        # a drained controller can be started again
+        self.accepting = True
+        self.tasks = []
+        self.provider_tasks = {}
+        for provider in self.providers:
+            self._start_provider(provider)
+
+    def _start_provider(self, provider: ProviderABC) -> None:
+        provider.closed = False
+        task = asyncio.create_task(provider.run())
+        self.tasks.append(task)
+        self.provider_tasks[provider.name] = task
+
+    async def _stop_provider(self, provider: ProviderABC) -> None:
+        """
+        Stop the task of a provider without losing its in-flight request.
+        """
+        provider.close()
+        task = self.provider_tasks.pop(provider.name, None)
+        if task is None:
+            return
+        self.tasks.remove(task)
+        if provider.in_flight == 0:
+            # the task is waiting without holding any request, so it is safe to cancel
+            task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
 
     async def wait_for_complete(self):
         """
@@ -78,11 +473,131 @@ class Controller:
                 await provider.pending_request_queue.join()
                 await provider.queue.join()
 
+    async def drain(
+        self, timeout: float | None = None, journal_path: str | os.PathLike | None = None
+    ) -> list[JobRequest]:
+        """
+        Stop gracefully, unlike `stop` no request is lost.
+
+        New requests are rejected, the in-flight requests are finished and the requests
+        that are due before the deadline are sent on the full rate limit of their providers.
+        Then the providers are stopped and the requests that have not been sent are returned.
+        The controller accepts requests again when it is started.
+
+        Args:
+            timeout (float, optional): The seconds to wait for flushing the due requests.
+                Defaults to None, which means the requests that are due now are flushed
+                however long it takes.
+            journal_path (str | PathLike, optional): The file to persist the requests that
+                have not been sent, they can be submitted again by `restore_journal`.
+                The recurring requests are frozen and persisted with their next execution time.
+
+        Returns:
+            list[JobRequest]: The requests that have not been sent.
+        """
+        self.accepting = False
+        # the sent occurrences must not queue the next ones while draining
+        for recurring_request in self.recurring_requests:
+            recurring_request.freeze()
+        deadline = time.time() + timeout if timeout is not None else None
+        if self.running:
+            while not all(self._is_flushed(provider, deadline) for provider in self.providers):
+                if deadline is not None and time.time() >= deadline:
+                    logger.warning("drain deadline has been reached")
+                    break
+                await asyncio.sleep(0.01)
+        remaining = []
+        for provider in self.providers:
+            await self._stop_provider(provider)
+            remaining.extend(provider.drain_requests())
+        self.stop()
+        recurring_requests = [
+            recurring_request
+            for recurring_request in self.recurring_requests
+            if not recurring_request.cancelled
+        ]
+        self.recurring_requests = []
+        if journal_path is not None:
+            # the queued occurrence of a definition is persisted by the definition itself
+            write_journal(
+                journal_path,
+                [
+                    request
+                    for request in remaining
+                    if request.recurrence is None or request.recurrence.cancelled
+                ]
+                + recurring_requests,
+            )
+        logger.info(f"drained, {len(remaining)} requests have not been sent")
+        return remaining
+
+    @staticmethod
+    def _is_flushed(provider: ProviderABC, deadline: float | None) -> bool:
+        """
+        Check that the provider has nothing to send before the deadline.
+        """
+        if not provider.enabled.is_set():
+            # a disabled provider can not flush its requests
+            return True
+        if provider.in_flight or provider.queue.qsize():
+            return False
+        next_pending_time = provider.next_pending_time()
+        if next_pending_time is None:
+            return True
+        return next_pending_time > (deadline if deadline is not None else time.time())
+
+    def restore_journal(self, journal_path: str | os.PathLike) -> list[JobRequest]:
+        """
+        Submit again the requests and the recurring requests that have been persisted by `drain`.
+        Raises KeyError if a provider of the requests has not been added.
+
+        Returns:
+            list[JobRequest]: The submitted requests.
+        """
+        if not self.accepting:
+            raise RuntimeError("controller is draining and does not accept new requests")
+        records = read_journal(journal_path)
+        # check every provider first, so a missing one doesn't restore half of the journal
+        for record in records:
+            self.providers[record["provider"]]
+        requests = []
+        for record in records:
+            if record.get("kind") == "recurring_request":
+                recurring_request = RecurringRequest.from_dict(
+                    record, self.providers[record["provider"]]
+                )
+                request = recurring_request.resume_request()
+                recurring_request.provider.add_request(request)
+                self.recurring_requests.append(recurring_request)
+                requests.append(request)
+                continue
+            request = self.new_request_received(
+                provider=self.providers[record["provider"]],
+                priority=record["priority"],
+                execution_after=datetime.datetime.fromtimestamp(record["execution_time"]),
+                request_name=record["name"],
+                expires_after=(
+                    datetime.datetime.fromtimestamp(record["expiry_time"])
+                    if record.get("expiry_time") is not None
+                    else None
+                ),
+                tenant=record.get("tenant"),
+                payload=(
+                    PayloadRef.from_dict(record["payload"])
+                    if record.get("payload") is not None
+                    else None
+                ),
+            )
+            request.retry_count = record["retry_count"]
+            requests.append(request)
+        return requests
+
     def stop(self):
         """
         Stop all running tasks.
 
         This method cancels all running tasks associated with the Controller.
         """
+        self.running = False
         for task in self.tasks:
             task.cancel()
@@ -1,5 +1,15 @@
 from .adaptor import Provider, JobRequest
-from .utils import StatusCode, Response, CLIActions
+from .limiter import (
+    DistributedRateLimiter,
+    MemoryBackend,
+    FileBackend,
+    ServerBackend,
+    RateLimitServer,
+)
+from .recurrence import RecurringRequest, IntervalSchedule, CronSchedule
+from .payload import PayloadArena, PayloadRef, payload_view
+from .registry import RequestRegistry
+from .utils import StatusCode, Response, CLIActions, MissedRunPolicy
 
 __all__ = [
     "Provider",
@@ -7,4 +17,17 @@ __all__ = [
     "StatusCode",
     "Response",
     "CLIActions",
+    "DistributedRateLimiter",
+    "MemoryBackend",
+    "FileBackend",
+    "ServerBackend",
+    "RateLimitServer",
+    "RecurringRequest",
+    "IntervalSchedule",
+    "CronSchedule",
+    "MissedRunPolicy",
+    "RequestRegistry",
+    "PayloadArena",
+    "PayloadRef",
+    "payload_view",
 ]
@@ -1,21 +1,165 @@
 import asyncio
+import collections
+import copy
+import heapq
+import itertools
 from abc import ABC, abstractmethod
 from asyncio import PriorityQueue
-from typing import Protocol
+from typing import Callable, Protocol
 
+from request_manager.integration.payload import Payload, PayloadRef, payload_view
+from request_manager.integration.stats import WaitHistogram
 from request_manager.integration.utils import Response
+from request_manager.log import logger
 
 import datetime
 import time
 
 
+class RequestQueue(PriorityQueue):
+    """
+    A priority queue of `(priority, request)` items that can drop its cancelled items.
+    """
+
+    def compact(self) -> int:
+        """
+        Remove the items of the finished requests, it is O(n) so it is called rarely.
+
+        Returns:
+            int: The number of the removed items.
+        """
+        items = [item for item in self._queue if not item[1].finished]
+        removed = len(self._queue) - len(items)
+        for _, request in self._queue:
+            if request.finished:
+                request.queued = False
+        heapq.heapify(items)
+        self._queue[:] = items
+        for _ in range(removed):
+            self.task_done()
+        return removed
+
+
+class PendingRequestQueue(RequestQueue):
+    """
+    A priority queue of `(execution_time, request)` items.
+    """
+
+    def next_execution_time(self) -> float | None:
+        """Return the execution time of the first pending request, None if it is empty."""
+        if not self._queue:
+            return None
+        execution_time, _ = self._queue[0]
+        return execution_time
+
+
+class FairRequestQueue(RequestQueue):
+    """
+    A `RequestQueue` that shares the dispatches between the tenants of its requests.
+
+    Each tenant has its own priority heap and the tenants are served by deficit round
+    robin: in every round a tenant earns its weight in dispatches, so a tenant with
+    weight 2 gets twice the dispatches of a tenant with weight 1 while both have
+    queued requests. The priority applies only between the requests of a tenant.
+    A dispatch is O(log n) in the heap of the tenant and O(1) in the number of tenants.
+
+    Attributes:
+        weights (dict): The weight of each tenant, 1 if it is not set.
+    """
+
+    def _init(self, maxsize):
+        # the base class only uses `_queue` for its repr, the items are in the heaps
+        self._queue = []
+        self.weights: dict[str | None, float] = {}
+        self._heaps: dict[str | None, list] = {}
+        self._deficits: dict[str | None, float] = {}
+        # the tenants that have queued requests, in the order they are served
+        self._ring: collections.deque = collections.deque()
+        self._size = 0
+
+    def qsize(self) -> int:
+        return self._size
+
+    def empty(self) -> bool:
+        return not self._size
+
+    def tenant_size(self, tenant: str | None) -> int:
+        """Return the number of the queued items of `tenant`."""
+        return len(self._heaps.get(tenant, ()))
+
+    def _put(self, item):
+        tenant = item[1].tenant
+        heap = self._heaps.get(tenant)
+        if heap is None:
+            heap = self._heaps[tenant] = []
+            self._deficits[tenant] = 0
+            self._ring.append(tenant)
+        heapq.heappush(heap, item)
+        self._size += 1
+
+    def _get(self):
+        ring = self._ring
+        while True:
+            tenant = ring[0]
+            if self._deficits[tenant] < 1:
+                self._deficits[tenant] += self.weights.get(tenant, 1)
+                if self._deficits[tenant] < 1:
+                    # a weight below 1 is served once in several rounds
+                    ring.rotate(-1)
+                    continue
+            break
+        heap = self._heaps[tenant]
+        item = heapq.heappop(heap)
+        self._size -= 1
+        self._deficits[tenant] -= 1
+        if not heap:
+            # an idle tenant does not keep its deficit for later
+            ring.popleft()
+            del self._heaps[tenant]
+            del self._deficits[tenant]
+        elif self._deficits[tenant] < 1:
+            ring.rotate(-1)
+        return item
+
+    def compact(self) -> int:
+        """
+        Remove the items of the finished requests from the heaps of the tenants.
+
+        Returns:
+            int: The number of the removed items.
+        """
+        removed = 0
+        for tenant, heap in list(self._heaps.items()):
+            items = [item for item in heap if not item[1].finished]
+            for _, request in heap:
+                if request.finished:
+                    request.queued = False
+            removed += len(heap) - len(items)
+            if items:
+                heapq.heapify(items)
+                self._heaps[tenant] = items
+            else:
+                del self._heaps[tenant]
+                del self._deficits[tenant]
+        self._ring = collections.deque(tenant for tenant in self._ring if tenant in self._heaps)
+        self._size -= removed
+        for _ in range(removed):
+            self.task_done()
+        return removed
+
+
 class JobRequestABC(ABC):
+    _ids = itertools.count()
+
     def __init__(
         self,
         provider: "ProviderABC",
         priority: int,
         execution_after: datetime.datetime | int = 0,
         name: str = "",
+        expires_after: datetime.datetime | int | None = None,
+        tenant: str | None = None,
+        payload: Payload | None = None,
     ):
         """
         Initialize a JobRequest object.
@@ -27,24 +171,75 @@ class JobRequestABC(ABC):
                 It can be either a datetime object or an integer representing seconds from the current time.
                 Defaults to 0, which means immediate execution.
             name (str, optional): A name or identifier for the job request. Defaults to an empty string.
+            expires_after (datetime.datetime | int, optional): The deadline of sending the request,
+                a datetime object or seconds from the current time. The request is dropped if it
+                has not been sent before it. Defaults to None, which means it never expires.
+            tenant (str, optional): The tenant that owns the request, the providers with fair
+                queueing share their dispatches between the tenants. Defaults to None.
+            payload (bytes | memoryview | PayloadRef, optional): The body of the request, it is
+                kept as it is and passed to `send_request` without copies. A `PayloadRef`
+                keeps the body in a `PayloadArena` file instead of the memory. Defaults to None.
         """
+        self.id = next(JobRequestABC._ids)
         self.name = name
+        self.tenant = tenant
+        self.payload = payload
         self.provider = provider
         self.retry_count = 0
+        # the RecurringRequest that has created this request, if it is an occurrence
+        self.recurrence = None
         # for use in PriorityQueue we must invert the priority to act as a max-heap
         self.priority = priority * -1
         if isinstance(execution_after, datetime.datetime):
             self.execution_time = execution_after.timestamp()
         elif isinstance(execution_after, int):
             self.execution_time = time.time() + execution_after
+        if isinstance(expires_after, datetime.datetime):
+            self.expiry_time = expires_after.timestamp()
+        elif isinstance(expires_after, int):
+            self.expiry_time = time.time() + expires_after
+        else:
+            self.expiry_time = None
+        # set when the request has been sent or dropped, its leftovers in the queues are skipped
+        self.finished = False
+        # set while the request is in the queues of its provider, not in-flight
+        self.queued = False
+
+    def copy(self) -> "JobRequestABC":
+        """Return a copy with the same id, used to replace a queued request."""
+        request = copy.copy(self)
+        request.finished = False
+        request.queued = False
+        return request
 
     def __repr__(self):
         return (
-            f"JobRequest(name={self.name}, priority={self.priority * -1},"
+            f"JobRequest(id={self.id}, name={self.name}, priority={self.priority * -1},"
             f" execution_time={datetime.datetime.fromtimestamp(self.execution_time).strftime('%H:%M:%S')},"
             f" provider={self.provider.name})"
         )
 
+    def payload_view(self) -> memoryview | None:
+        """Return a memoryview of the payload without copying it, None if there is no payload."""
+        return None if self.payload is None else payload_view(self.payload)
+
+    def to_dict(self) -> dict:
+        """
+        Return the fields of the request that are needed to submit it again.
+        A `PayloadRef` is returned as its record, a bytes or memoryview payload as it is.
+        """
+        payload = self.payload
+        return {
+            "name": self.name,
+            "provider": self.provider.name,
+            "priority": self.priority * -1,
+            "execution_time": self.execution_time,
+            "retry_count": self.retry_count,
+            "expiry_time": self.expiry_time,
+            "tenant": self.tenant,
+            "payload": payload.to_dict() if isinstance(payload, PayloadRef) else payload,
+        }
+
     @abstractmethod
     def __lt__(self, other: "JobRequestABC"):
         """Return a string representation of the JobRequest object."""
@@ -53,6 +248,10 @@ class JobRequestABC(ABC):
     def is_ready(self) -> bool:
         """Check if the job request is ready for execution."""
 
+    def is_expired(self) -> bool:
+        """Check if the deadline of the job request has been passed."""
+        return self.expiry_time is not None and time.time() >= self.expiry_time
+
 
 class ProviderABC(ABC):
     """
@@ -63,18 +262,65 @@ class ProviderABC(ABC):
         rate_limit (float): The rate limit for sending requests per second.
         last_request_time (float): The timestamp of the last sent request.
         enabled (asyncio.Event): An event that controls whether the provider is enabled.
-        queue (asyncio.PriorityQueue): A priority queue for pending requests.
-        pending_request_queue (asyncio.PriorityQueue): A priority queue for pending requests that are not ready.
+        queue (RequestQueue): A priority queue for pending requests.
+        pending_request_queue (PendingRequestQueue): A queue of the requests that are not ready,
+            ordered by their execution time.
+        rate_limiter (RateLimiterABC | None): A shared limiter used instead of the local
+            rate limit bookkeeping when several processes send with the same provider.
+        in_flight (int): The number of requests that have been taken from the queue and not sent yet.
+        closed (bool): When it is set the run loop exits after its in-flight request.
+        on_expired (Callable[[JobRequest], None] | None): Called with each request that is
+            dropped because its deadline has been passed.
+        expired_count (int): The number of the expired requests.
+        expiry_index (list): A heap of `(expiry_time, request)` of the queued requests that
+            have a deadline, it is swept every `expiry_sweep_interval` seconds.
+        registry (RequestRegistry | None): The index of the queued requests, it is shared by
+            the providers of a controller.
+        tombstones (int): The number of the dropped requests that are still in the queues,
+            the queues are compacted when they are the majority.
+        tenant_quotas (dict): The maximum number of queued requests of each tenant.
+        tenant_counts (dict): The number of queued requests of each tenant.
+        sent_count (int): The number of the requests that have been sent successfully.
+        error_count (int): The number of the failed sends, the retries included.
+        queue_wait (WaitHistogram): The seconds between the execution time of the sent
+            requests and their send.
     """
 
-    def __init__(self, name: str, rate_limit: float) -> None:
+    expiry_sweep_interval = 1.0
+    # the queues are not compacted for fewer dropped requests
+    compact_threshold = 1024
+
+    def __init__(
+        self,
+        name: str,
+        rate_limit: float,
+        rate_limiter: "RateLimiterABC | None" = None,
+        on_expired: Callable[[JobRequestABC], None] | None = None,
+        fair_queueing: bool = False,
+    ) -> None:
         self.name = name
         self.rate_limit = rate_limit
+        self.rate_limiter = rate_limiter
+        self.on_expired = on_expired
+        self.expired_count = 0
+        self.expiry_index = []
+        self.last_sweep_time = time.time()
         self.last_request_time = time.time() - (1 / rate_limit)
         self.enabled = asyncio.Event()
         self.enabled.set()
-        self.queue = PriorityQueue()
-        self.pending_request_queue = PriorityQueue()
+        self.queue = FairRequestQueue() if fair_queueing else RequestQueue()
+        self.pending_request_queue = PendingRequestQueue()
+        self.in_flight = 0
+        self.closed = False
+        self.registry = None
+        self.tombstones = 0
+        self.tenant_quotas: dict[str | None, int] = {}
+        self.tenant_counts: dict[str | None, int] = {}
+        # cheap counters for the monitor, it must not walk the queues
+        self.created_time = time.time()
+        self.sent_count = 0
+        self.error_count = 0
+        self.queue_wait = WaitHistogram()
 
     @abstractmethod
     async def wait_for_rate_limit(self) -> bool:
@@ -128,6 +374,171 @@ class ProviderABC(ABC):
         Disable the provider to stop sending requests.
         """
 
+    def close(self) -> None:
+        """
+        Exit from the run loop after the in-flight request has been sent.
+        """
+        self.closed = True
+
+    def add_request(self, request: JobRequestABC) -> None:
+        """
+        Add a request to the queue of this provider.
+        """
+        self.queue.put_nowait((request.priority, request))
+        request.queued = True
+        self._count_tenant(request.tenant, 1)
+        if request.expiry_time is not None:
+            heapq.heappush(self.expiry_index, (request.expiry_time, request))
+        if self.registry is not None:
+            self.registry.register(request)
+
+    def take_request(self, request: JobRequestABC) -> None:
+        """
+        Mark a request that has been taken from the queues, it is in-flight or skipped.
+        """
+        if request.finished and request.queued:
+            self.tombstones -= 1
+        elif request.queued:
+            self._count_tenant(request.tenant, -1)
+        request.queued = False
+        if self.registry is not None:
+            self.registry.unregister(request)
+
+    def drop_request(self, request: JobRequestABC) -> bool:
+        """
+        Drop a queued request in O(1), it stays in the queues until it is taken and skipped.
+
+        Returns:
+            bool: False if the request is not queued anymore, e.g. it is in-flight.
+        """
+        if request.finished or not request.queued:
+            return False
+        request.finished = True
+        self.tombstones += 1
+        self._count_tenant(request.tenant, -1)
+        if self.registry is not None:
+            self.registry.unregister(request)
+        if self.tombstones >= self.compact_threshold and self.tombstones * 2 > (
+            self.queue.qsize() + self.pending_request_queue.qsize()
+        ):
+            self.compact()
+        return True
+
+    def compact(self) -> None:
+        """
+        Remove the dropped requests from the queues.
+        """
+        removed = self.queue.compact() + self.pending_request_queue.compact()
+        self.expiry_index = [item for item in self.expiry_index if not item[1].finished]
+        heapq.heapify(self.expiry_index)
+        self.tombstones = 0
+        logger.info(f"provider[{self.name}] queues compacted, {removed} dropped requests removed")
+
+    def evict_expired(self, request: JobRequestABC) -> None:
+        """
+        Drop an expired request and report it.
+        """
+        if request.queued:
+            self.drop_request(request)
+        else:
+            request.finished = True
+        self.expired_count += 1
+        logger.info(f"request[{request.name}] in provider[{self.name}] has been expired")
+        if self.on_expired is not None:
+            self.on_expired(request)
+
+    def sweep_expired(self) -> int:
+        """
+        Drop the expired requests by the expiry index, without scanning the queues.
+
+        Returns:
+            int: The number of the dropped requests.
+        """
+        self.last_sweep_time = now = time.time()
+        count = 0
+        while self.expiry_index and self.expiry_index[0][0] <= now:
+            _, request = heapq.heappop(self.expiry_index)
+            # the request may have been sent, be in-flight or moved to another provider
+            if request.finished or not request.queued or request.provider is not self:
+                continue
+            self.evict_expired(request)
+            count += 1
+        return count
+
+    def _count_tenant(self, tenant: str | None, delta: int) -> None:
+        count = self.tenant_counts.get(tenant, 0) + delta
+        if count:
+            self.tenant_counts[tenant] = count
+        else:
+            self.tenant_counts.pop(tenant, None)
+
+    def check_tenant_quota(self, tenant: str | None) -> None:
+        """
+        Raise `asyncio.QueueFull` if `tenant` has as many queued requests as its quota.
+        """
+        quota = self.tenant_quotas.get(tenant)
+        if quota is not None and self.tenant_counts.get(tenant, 0) >= quota:
+            raise asyncio.QueueFull(
+                f"tenant {tenant} has {quota} queued requests in provider {self.name}"
+            )
+
+    def set_tenant_quota(self, tenant: str | None, quota: int | None) -> None:
+        """
+        Limit the number of queued requests of a tenant, None removes the limit.
+        The requests that are already queued are kept.
+        """
+        if quota is None:
+            self.tenant_quotas.pop(tenant, None)
+            return
+        if quota < 0:
+            raise ValueError(f"tenant quota must not be negative, got {quota}")
+        self.tenant_quotas[tenant] = quota
+
+    def set_tenant_weight(self, tenant: str | None, weight: float) -> None:
+        """
+        Change the share of the dispatches of a tenant, it is used from the next round.
+        """
+        if not isinstance(self.queue, FairRequestQueue):
+            raise ValueError(f"provider {self.name} does not use fair queueing")
+        if weight <= 0:
+            raise ValueError(f"tenant weight must be positive, got {weight}")
+        self.queue.weights[tenant] = weight
+
+    def set_rate_limit(self, rate_limit: float) -> None:
+        """
+        Change the rate limit, the running loop uses it from its next request.
+        """
+        if rate_limit <= 0:
+            raise ValueError(f"rate limit must be positive, got {rate_limit}")
+        logger.info(f"provider[{self.name}] rate limit {self.rate_limit} -> {rate_limit}")
+        self.rate_limit = rate_limit
+
+    def next_pending_time(self) -> float | None:
+        """
+        Return the execution time of the first pending request, None if there is no pending request.
+        """
+        return self.pending_request_queue.next_execution_time()
+
+    def drain_requests(self) -> list[JobRequestABC]:
+        """
+        Remove and return every request that is waiting in the queues.
+        """
+        requests = []
+        for queue in (self.queue, self.pending_request_queue):
+            while not queue.empty():
+                _, request = queue.get_nowait()
+                queue.task_done()
+                self.take_request(request)
+                if request.finished:
+                    continue
+                if request.is_expired():
+                    self.evict_expired(request)
+                    continue
+                requests.append(request)
+        self.expiry_index = []
+        self.tombstones = 0
+        return requests
+
     def __repr__(self):
         last_request_time_formated = datetime.datetime.fromtimestamp(
             self.last_request_time
@@ -142,3 +553,55 @@ class ProviderABC(ABC):
         """
         return queue size
         """
+
+
+class SharedStateBackendABC(ABC):
+    """
+    Shared state used by a distributed rate limiter.
+
+    The backend owns, per key, the next free send slot of every limiter that shares it.
+    """
+
+    @abstractmethod
+    async def reserve(self, key: str, count: int, interval: float) -> float:
+        """
+        Reserve `count` consecutive send slots spaced by `interval` seconds.
+
+        Args:
+            key (str): The key of the shared rate limit, usually the provider name.
+            count (int): The number of slots to lease.
+            interval (float): The spacing between two slots (1 / rate_limit).
+
+        Returns:
+            float: The local timestamp of the first reserved slot.
+        """
+
+    async def release(self, key: str, end: float, count: int, interval: float) -> bool:
+        """
+        Give back the last `count` slots of a lease that ends at the `end` timestamp.
+
+        The slots can only be given back if nobody has reserved after them.
+
+        Returns:
+            bool: True if the slots have been given back.
+        """
+        return False
+
+
+class RateLimiterABC(ABC):
+    @abstractmethod
+    async def acquire(self, key: str, rate_limit: float, backlog: int = 1) -> None:
+        """
+        Wait until a request may be sent under the rate limit of `key`.
+
+        Args:
+            key (str): The key of the shared rate limit, usually the provider name.
+            rate_limit (float): The allowed requests per second for all the limiter users.
+            backlog (int, optional): The number of requests that are waiting to be sent,
+                a limiter may use it to size its leases.
+        """
+
+    async def release(self, key: str) -> None:
+        """
+        Give back the slots of `key` that have been leased and are not needed anymore.
+        """
@@ -7,6 +7,9 @@ from request_manager.log import logger
 from .abc import JobRequestABC, ProviderABC
 from .utils import StatusCode, Response
 
+# seconds to wait before trying the rate limiter again when its backend has failed
+RATE_LIMITER_RETRY_DELAY = 1
+
 
 class JobRequest(JobRequestABC):
     def __lt__(self, other: "JobRequest"):
@@ -27,8 +30,28 @@ class Provider(ProviderABC):
         rate_limit (float): The rate limit for sending requests per second.
         last_request_time (float): The timestamp of the last sent request.
         enabled (asyncio.Event): An event that controls whether the provider is enabled.
-        queue (asyncio.PriorityQueue): A priority queue for pending requests.
-        pending_request_queue (asyncio.PriorityQueue): A priority queue for pending requests that are not ready.
+        queue (RequestQueue): A priority queue for pending requests.
+        pending_request_queue (PendingRequestQueue): A queue of the requests that are not ready,
+            ordered by their execution time.
+        rate_limiter (RateLimiterABC | None): A shared limiter used instead of the local
+            rate limit bookkeeping when several processes send with the same provider.
+        in_flight (int): The number of requests that have been taken from the queue and not sent yet.
+        closed (bool): When it is set the run loop exits after its in-flight request.
+        on_expired (Callable[[JobRequest], None] | None): Called with each request that is
+            dropped because its deadline has been passed.
+        expired_count (int): The number of the expired requests.
+        expiry_index (list): A heap of `(expiry_time, request)` of the queued requests that
+            have a deadline, it is swept every `expiry_sweep_interval` seconds.
+        registry (RequestRegistry | None): The index of the queued requests, it is shared by
+            the providers of a controller.
+        tombstones (int): The number of the dropped requests that are still in the queues,
+            the queues are compacted when they are the majority.
+        tenant_quotas (dict): The maximum number of queued requests of each tenant.
+        tenant_counts (dict): The number of queued requests of each tenant.
+        sent_count (int): The number of the requests that have been sent successfully.
+        error_count (int): The number of the failed sends, the retries included.
+        queue_wait (WaitHistogram): The seconds between the execution time of the sent
+            requests and their send.
     """
 
     async def wait_for_rate_limit(self) -> None:
@@ -70,19 +93,25 @@ class Provider(ProviderABC):
 
     async def check_pending_request(self) -> None:
         """
-        Check and process pending requests in the queue.
+        Move the pending requests that are ready to the master queue.
         """
-        if self.pending_request_queue.qsize() == 0:
-            return
-        priority, request = await self.pending_request_queue.get()
-        if request.is_ready():
+        while self.pending_request_queue.qsize() != 0:
+            execution_time, request = await self.pending_request_queue.get()
+            if request.finished:
+                # dropped while it was pending
+                self.take_request(request)
+                self.pending_request_queue.task_done()
+                continue
+            if not request.is_ready():
+                # the queue is ordered by execution time, so the others are not ready either
+                await self.pending_request_queue.put((execution_time, request))
+                self.pending_request_queue.task_done()
+                return
             logger.info(
                 f"add pending request[{request.name}] to master queue in provider[{self.name}]"
             )
-            await self.queue.put((priority, request))
-        else:
-            await self.pending_request_queue.put((priority, request))
-        self.pending_request_queue.task_done()
+            await self.queue.put((request.priority, request))
+            self.pending_request_queue.task_done()
 
     async def _run_job(self) -> None:
         """
@@ -92,27 +121,70 @@ class Provider(ProviderABC):
         If a job is ready (arrived at execution time), send the request.
         If a job is not ready, send it to the pending queue.
         If a job fails, it will be retried up to 3 times before being dropped.
+        If a job has been expired, it is dropped without spending the rate limit.
         @todo The hardcoded value for the retry count should be changed and
             the errors should be save for tracking.
         """
         await self.enabled.wait()
-        await self.wait_for_rate_limit()
+        if self.rate_limiter is None:
+            await self.wait_for_rate_limit()
         await self.check_pending_request()
+        if time.time() - self.last_sweep_time >= self.expiry_sweep_interval:
+            self.sweep_expired()
         request: JobRequest
-        if self.pending_request_queue.qsize() == 0 and self.queue.qsize() == 0:
+        if self.queue.qsize() == 0:
+            # the ready pending requests have been moved, so there is nothing to send now.
             # used for not block program in this coroutine
             await asyncio.sleep(0.001)
         if self.pending_request_queue.qsize() >= 0 and self.queue.qsize() == 0:
+            if self.rate_limiter is not None:
+                # give the leased slots back to the other limiter users while idle
+                await self.rate_limiter.release(self.name)
             return
         priority, request = await self.queue.get()
+        if request.finished or request.is_expired():
+            # skip it without spending the rate limit
+            self.take_request(request)
+            if not request.finished:
+                self.evict_expired(request)
+            self.queue.task_done()
+            return
         if not request.is_ready():
             logger.info(
                 f"add request[{request.name}] to pending queue in provider[{self.name}]"
             )
-            self.pending_request_queue.put_nowait((priority, request))
+            self.pending_request_queue.put_nowait((request.execution_time, request))
             self.queue.task_done()
             return
+        self.take_request(request)
+        self.in_flight += 1
+        try:
+            await self._send_job(priority, request)
+        finally:
+            self.in_flight -= 1
+            self.queue.task_done()
+
+    async def _send_job(self, priority: int, request: JobRequest) -> None:
+        """
+        Send a ready job and put it back on the queue if it has failed.
+        """
+        if self.rate_limiter is not None:
+            # the shared slot is taken only when there is a request to send
+            try:
+                await self.rate_limiter.acquire(
+                    self.name, self.rate_limit, backlog=self.queue.qsize() + 1
+                )
+            except (OSError, ValueError) as e:
+                logger.error(f"rate limiter of provider {self.name} failed: {e}")
+                self.add_request(request)
+                await asyncio.sleep(RATE_LIMITER_RETRY_DELAY)
+                return
+        self.queue_wait.record(time.time() - request.execution_time)
         result = await self.send_request(request)
+        if result.status_code == StatusCode.SUCCESS:
+            self.sent_count += 1
+        else:
+            self.error_count += 1
         current_time = datetime.datetime.now().strftime("%H:%M:%S")
         msg = (
             "Sent request {} to provider {} with priority {} at {}"
@@ -132,19 +204,22 @@ class Provider(ProviderABC):
         logger.info(f'{"+" * 100}\n')
         if request.retry_count >= 3:
             logging.error(f"{request} in provider {self.name} has been retried 3 times")
-            self.queue.task_done()
-            return
-        if result.status_code != StatusCode.SUCCESS:
+        elif result.status_code != StatusCode.SUCCESS:
             request.retry_count += 1
-            await self.queue.put((priority, request))
-        self.queue.task_done()
+            self.add_request(request)
+            return
+        request.finished = True
+        if request.recurrence is not None:
+            next_request = request.recurrence.next_request(request)
+            if next_request is not None:
+                next_request.provider.add_request(next_request)
 
     async def run(self) -> None:
         """
         infinite loop for run jobs on the queue
         if queue is empty it must wait until its filled
         """
-        while True:  # TODO replace with better solution
+        while not self.closed:  # TODO replace with better solution
             await self._run_job()
 
     def stop(self) -> None:
@@ -157,7 +232,7 @@ class Provider(ProviderABC):
         """
         return queues size
         """
-        return self.queue.qsize() + self.pending_request_queue.qsize()
+        return self.queue.qsize() + self.pending_request_queue.qsize() - self.tombstones
 
 
 class ProviderContainer:
@@ -176,6 +251,17 @@ class ProviderContainer:
     def __setitem__(self, key: str, item: ProviderABC):
         self.container[key] = item
 
+    def __delitem__(self, item: ProviderABC | str):
+        if isinstance(item, str):
+            del self.container[item]
+        else:
+            del self.container[item.name]
+
+    def __contains__(self, item: ProviderABC | str) -> bool:
+        if isinstance(item, str):
+            return item in self.container
+        return self.container.get(item.name) is item
+
     def __add__(self, other: ProviderABC):
         self.container[other.name] = other
         return self
@@ -0,0 +1,285 @@
+import asyncio
+import collections
+import dataclasses
+import fcntl
+import json
+import os
+import time
+
+from request_manager.log import logger
+from .abc import RateLimiterABC, SharedStateBackendABC
+
+
+class MemoryBackend(SharedStateBackendABC):
+    """
+    Keep the shared slots in memory.
+    it is only shared between limiters of the same process, and it is the state
+    used by `RateLimitServer` to serve the other hosts.
+    """
+
+    def __init__(self):
+        self.next_slots: dict[str, float] = {}
+
+    def reserve_now(self, key: str, count: int, interval: float, now: float) -> float:
+        start = max(self.next_slots.get(key, now), now)
+        self.next_slots[key] = start + count * interval
+        return start
+
+    def release_now(self, key: str, end: float, count: int, interval: float) -> bool:
+        if self.next_slots.get(key) != end:
+            return False
+        self.next_slots[key] = end - count * interval
+        return True
+
+    async def reserve(self, key: str, count: int, interval: float) -> float:
+        return self.reserve_now(key, count, interval, time.time())
+
+    async def release(self, key: str, end: float, count: int, interval: float) -> bool:
+        return self.release_now(key, end, count, interval)
+
+
+class FileBackend(SharedStateBackendABC):
+    """
+    Keep the shared slots in a json file guarded by an exclusive `flock`.
+    use it for the processes that run on the same host.
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        self.path = os.fspath(path)
+
+    def _update(self, update) -> float | bool:
+        """
+        Call `update` with the shared slots while the file is locked and save them.
+        """
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, "r+") as state_file:
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            try:
+                content = state_file.read()
+                backend = MemoryBackend()
+                backend.next_slots = json.loads(content) if content else {}
+                result = update(backend)
+                state_file.seek(0)
+                state_file.truncate()
+                json.dump(backend.next_slots, state_file)
+                state_file.flush()
+            finally:
+                fcntl.flock(state_file, fcntl.LOCK_UN)
+        return result
+
+    async def reserve(self, key: str, count: int, interval: float) -> float:
+        return await asyncio.to_thread(
+            self._update, lambda backend: backend.reserve_now(key, count, interval, time.time())
+        )
+
+    async def release(self, key: str, end: float, count: int, interval: float) -> bool:
+        return await asyncio.to_thread(
+            self._update, lambda backend: backend.release_now(key, end, count, interval)
+        )
+
+
+class ServerBackend(SharedStateBackendABC):
+    """
+    Lease the slots from a `RateLimitServer`.
+
+    The server answers with the delay of the first slot instead of a timestamp,
+    so the hosts don't need synchronized clocks.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._lock = asyncio.Lock()
+        # the end of the last lease of each key in local and in server time,
+        # the server needs its own timestamp to release the lease
+        self._lease_ends: dict[str, tuple[float, float]] = {}
+
+    async def _connect(self) -> None:
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    async def _call(self, message: dict) -> dict:
+        async with self._lock:
+            for attempt in range(2):
+                if self._writer is None:
+                    await self._connect()
+                try:
+                    self._writer.write(json.dumps(message).encode() + b"\n")
+                    await self._writer.drain()
+                    line = await self._reader.readline()
+                    if not line:
+                        raise ConnectionError("rate limit server closed the connection")
+                except ConnectionError:
+                    # reconnect once, the server may have been restarted
+                    await self.close()
+                    if attempt:
+                        raise
+                    continue
+                response = json.loads(line)
+                if "error" in response:
+                    raise ValueError(f"rate limit server error: {response['error']}")
+                return response
+
+    async def reserve(self, key: str, count: int, interval: float) -> float:
+        response = await self._call(
+            {"command": "reserve", "key": key, "count": count, "interval": interval}
+        )
+        start = time.time() + response["delay"]
+        self._lease_ends[key] = (start + count * interval, response["end"])
+        return start
+
+    async def release(self, key: str, end: float, count: int, interval: float) -> bool:
+        local_end, server_end = self._lease_ends.get(key, (None, None))
+        if local_end != end:
+            return False
+        response = await self._call(
+            {
+                "command": "release",
+                "key": key,
+                "end": server_end,
+                "count": count,
+                "interval": interval,
+            }
+        )
+        return response["released"]
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except ConnectionError:
+                pass
+        self._reader = self._writer = None
+
+
+class RateLimitServer:
+    """
+    A tiny tcp server that owns the shared slots of the `ServerBackend` clients.
+
+    protocol: json lines, the client sends
+    `{"command": "reserve", "key": ..., "count": ..., "interval": ...}` and the server
+    answers with the delay in seconds until the first reserved slot and the end of the
+    lease in server time. `{"command": "release", "key": ..., "end": ..., "count": ...,
+    "interval": ...}` gives back the unused slots of the last lease.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.backend = MemoryBackend()
+        self._server: asyncio.Server | None = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def _answer(self, message: dict) -> dict:
+        key, count, interval = message["key"], int(message["count"]), float(message["interval"])
+        if message["command"] == "reserve":
+            now = time.time()
+            start = self.backend.reserve_now(key, count, interval, now)
+            return {"delay": start - now, "end": start + count * interval}
+        if message["command"] == "release":
+            return {"released": self.backend.release_now(key, message["end"], count, interval)}
+        return {"error": f"unknown command {message['command']}"}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                try:
+                    response = self._answer(json.loads(line))
+                except (ValueError, KeyError, TypeError) as e:
+                    response = {"error": f"bad request {e}"}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError as e:
+            logger.warning(f"rate limit server dropped a client: {e}")
+        finally:
+            writer.close()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+@dataclasses.dataclass
+class Lease:
+    rate_limit: float
+    # the end of the lease, used to give back the unused slots
+    end: float
+    slots: collections.deque[float]
+
+
+class DistributedRateLimiter(RateLimiterABC):
+    """
+    Respect a rate limit shared by every limiter that uses the same backend and key.
+
+    Slots are leased from the backend in batches sized by the backlog of the caller,
+    so a busy provider contacts the backend once per `lease_size` requests while an
+    idle one leases a single slot and doesn't hold back the others.
+
+    Args:
+        backend (SharedStateBackendABC): The shared state of the rate limit.
+        lease_size (int): The maximum number of slots leased at once.
+        lease_duration (float): The maximum seconds a lease may cover, it keeps
+            slow providers from reserving slots far in the future.
+    """
+
+    def __init__(
+        self,
+        backend: SharedStateBackendABC,
+        lease_size: int = 10,
+        lease_duration: float = 0.2,
+    ):
+        self.backend = backend
+        self.lease_size = lease_size
+        self.lease_duration = lease_duration
+        self.leases: dict[str, Lease] = {}
+        self._lock = asyncio.Lock()
+
+    async def _next_slot(self, key: str, rate_limit: float, backlog: int) -> float:
+        interval = 1 / rate_limit
+        async with self._lock:
+            lease = self.leases.get(key)
+            if lease is not None and lease.rate_limit != rate_limit:
+                # the rate has been changed, the old slots have the wrong spacing
+                await self._release(key, lease)
+                lease = None
+            if lease is not None:
+                # a slot that has been missed can not be used later without a burst
+                now = time.time()
+                while lease.slots and lease.slots[0] < now - interval:
+                    lease.slots.popleft()
+            if lease is None or not lease.slots:
+                count = min(self.lease_size, max(1, backlog), int(rate_limit * self.lease_duration))
+                count = max(1, count)
+                start = await self.backend.reserve(key, count, interval)
+                lease = Lease(
+                    rate_limit=rate_limit,
+                    end=start + count * interval,
+                    slots=collections.deque(start + i * interval for i in range(count)),
+                )
+                self.leases[key] = lease
+            return lease.slots.popleft()
+
+    async def _release(self, key: str, lease: Lease) -> None:
+        self.leases.pop(key, None)
+        if lease.slots:
+            await self.backend.release(key, lease.end, len(lease.slots), 1 / lease.rate_limit)
+
+    async def acquire(self, key: str, rate_limit: float, backlog: int = 1) -> None:
+        slot = await self._next_slot(key, rate_limit, backlog)
+        delay = slot - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def release(self, key: str) -> None:
+        async with self._lock:
+            lease = self.leases.get(key)
+            if lease is not None:
+                await self._release(key, lease)
+
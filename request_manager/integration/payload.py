@@ -0,0 +1,106 @@
+import dataclasses
+import mmap
+import os
+import weakref
+
+# the arenas that are open in this process by their path, so the references that are
+# restored from a journal share one mapping
+_arenas: "weakref.WeakValueDictionary[str, PayloadArena]" = weakref.WeakValueDictionary()
+
+
+class PayloadArena:
+    """
+    An append-only file of request payloads that are read back through `mmap`.
+
+    The queued requests keep a small `PayloadRef` instead of their body, the bodies
+    stay in the page cache of the file and are read without copies.
+
+    Args:
+        path (str | PathLike): The file of the arena, it is created if it does not exist.
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        self.path = os.path.abspath(path)
+        self._file = open(self.path, "a+b")
+        self._mmap: mmap.mmap | None = None
+        self._mapped_size = 0
+        _arenas[self.path] = self
+
+    @classmethod
+    def open(cls, path: str | os.PathLike) -> "PayloadArena":
+        """Return the arena of `path` that is open in this process, or open it."""
+        arena = _arenas.get(os.path.abspath(path))
+        return arena if arena is not None else cls(path)
+
+    def append(self, data: bytes | memoryview) -> "PayloadRef":
+        """
+        Write a payload at the end of the arena.
+
+        Returns:
+            PayloadRef: The reference that reads the payload back.
+        """
+        offset = self._file.seek(0, os.SEEK_END)
+        length = self._file.write(data)
+        return PayloadRef(self, offset, length)
+
+    def view(self, offset: int, length: int) -> memoryview:
+        """Return a read-only view of `length` bytes at `offset`, without copying them."""
+        if length == 0:
+            return memoryview(b"")
+        if offset + length > self._mapped_size:
+            # map the file again after it has grown, the views of the old mapping keep it alive
+            self._file.flush()
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_size = len(self._mmap)
+            if offset + length > self._mapped_size:
+                raise ValueError(f"payload at {offset}+{length} is out of {self.path}")
+        return memoryview(self._mmap)[offset : offset + length]
+
+    def close(self) -> None:
+        """Write the appended payloads to the file and close it, the views stay valid."""
+        self._file.close()
+        self.forget(self.path)
+
+    @classmethod
+    def forget(cls, path: str | os.PathLike) -> None:
+        """
+        Stop resolving the references of `path` to the open arena, e.g. after the file has
+        been replaced. The existing references keep reading the old file.
+        """
+        _arenas.pop(os.path.abspath(path), None)
+
+
+@dataclasses.dataclass(frozen=True)
+class PayloadRef:
+    """
+    A reference to a payload in a `PayloadArena`.
+    """
+
+    arena: PayloadArena
+    offset: int
+    length: int
+
+    def view(self) -> memoryview:
+        return self.arena.view(self.offset, self.length)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def to_dict(self) -> dict:
+        return {"arena": self.arena.path, "offset": self.offset, "length": self.length}
+
+    @classmethod
+    def from_dict(cls, record: dict) -> "PayloadRef":
+        return cls(PayloadArena.open(record["arena"]), record["offset"], record["length"])
+
+
+Payload = bytes | memoryview | PayloadRef
+
+
+def payload_view(payload: Payload) -> memoryview:
+    """
+    Return a memoryview of any kind of payload without copying it.
+    """
+    if isinstance(payload, PayloadRef):
+        return payload.view()
+    return memoryview(payload)
@@ -0,0 +1,252 @@
+import datetime
+import math
+import time
+
+from request_manager.log import logger
+from .abc import ProviderABC
+from .adaptor import JobRequest
+from .utils import MissedRunPolicy
+
+
+class IntervalSchedule:
+    """
+    Occurrences every `interval` seconds starting at the `start` timestamp.
+    """
+
+    def __init__(self, interval: float, start: float):
+        if interval <= 0:
+            raise ValueError(f"interval must be positive, got {interval}")
+        self.interval = interval
+        self.start = start
+
+    def next_after(self, timestamp: float, inclusive: bool = False) -> float:
+        """
+        Return the first occurrence after `timestamp`, or at it when `inclusive` is set.
+        """
+        if timestamp < self.start:
+            return self.start
+        steps = (timestamp - self.start) / self.interval
+        step = math.ceil(steps) if inclusive else math.floor(steps) + 1
+        return self.start + step * self.interval
+
+
+class CronSchedule:
+    """
+    Occurrences of a standard 5 fields cron expression in local time.
+
+    fields are `minute hour day-of-month month day-of-week`, each of them accepts
+    `*`, `a`, `a-b`, `*/n`, `a-b/n` and comma separated lists of them.
+    """
+
+    # the longest time that an expression like `0 0 29 2 1` may need to match
+    search_limit = datetime.timedelta(days=366 * 28)
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron expression must have 5 fields, got {expression!r}")
+        self.expression = expression
+        self.minutes = self._parse_field(fields[0], 0, 59)
+        self.hours = self._parse_field(fields[1], 0, 23)
+        self.days = self._parse_field(fields[2], 1, 31)
+        self.months = self._parse_field(fields[3], 1, 12)
+        # both 0 and 7 are sunday
+        self.weekdays = {day % 7 for day in self._parse_field(fields[4], 0, 7)}
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> set[int]:
+        values = set()
+        for part in field.split(","):
+            value_range, _, step = part.partition("/")
+            if value_range == "*":
+                start, end = low, high
+            elif "-" in value_range:
+                start, end = map(int, value_range.split("-"))
+            else:
+                start = end = int(value_range)
+                if step:
+                    end = high
+            if not low <= start <= end <= high:
+                raise ValueError(f"cron field {field!r} is out of range {low}-{high}")
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def _day_matches(self, moment: datetime.datetime) -> bool:
+        # cron weekdays start from sunday
+        day_match = moment.day in self.days
+        weekday_match = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_match and weekday_match
+        # when both are restricted, matching one of them is enough
+        return day_match or weekday_match
+
+    def next_after(self, timestamp: float, inclusive: bool = False) -> float:
+        """
+        Return the first occurrence after `timestamp`, or at it when `inclusive` is set.
+        """
+        moment = datetime.datetime.fromtimestamp(timestamp)
+        start = moment.replace(second=0, microsecond=0)
+        if start < moment or not inclusive:
+            start += datetime.timedelta(minutes=1)
+        moment = start
+        while moment - start < self.search_limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1) + datetime.timedelta(days=32)).replace(
+                    day=1, hour=0, minute=0
+                )
+            elif not self._day_matches(moment):
+                moment = (moment + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+            elif moment.hour not in self.hours:
+                moment = (moment + datetime.timedelta(hours=1)).replace(minute=0)
+            elif moment.minute not in self.minutes:
+                moment += datetime.timedelta(minutes=1)
+            else:
+                return moment.timestamp()
+        raise ValueError(f"cron expression {self.expression!r} never matches")
+
+
+class RecurringRequest:
+    """
+    A definition of requests that repeat on a schedule.
+
+    Only the next occurrence is queued, the one after it is created when the
+    provider has finished with the current occurrence. So the memory is bound
+    to the number of definitions, not to the number of occurrences.
+
+    Attributes:
+        schedule (IntervalSchedule | CronSchedule): The times of the occurrences.
+        provider (Provider): The provider of the occurrences.
+        priority (int): The priority of the occurrences.
+        name (str): The name of the definition, occurrences are named `name#n`.
+        missed_runs (MissedRunPolicy): What to do with the occurrences that have been
+            missed, e.g. while the provider was disabled.
+        occurrence_count (int): The number of occurrences that have been created.
+        next_execution_time (float | None): The execution time of the occurrence that
+            has been created or skipped last.
+        cancelled (bool): No occurrence is created after the definition is cancelled.
+        frozen (bool): The next occurrence is only recorded in `next_execution_time`,
+            it is used by `Controller.drain` to persist the definition.
+    """
+
+    def __init__(
+        self,
+        schedule: IntervalSchedule | CronSchedule,
+        provider: ProviderABC,
+        priority: int = 10,
+        name: str = "",
+        missed_runs: MissedRunPolicy = MissedRunPolicy.SKIP,
+    ):
+        self.schedule = schedule
+        self.provider = provider
+        self.priority = priority
+        self.name = name
+        self.missed_runs = missed_runs
+        self.occurrence_count = 0
+        self.next_execution_time = None
+        self.cancelled = False
+        self.frozen = False
+
+    def _create_request(self, execution_time: float) -> JobRequest:
+        request = JobRequest(
+            provider=self.provider,
+            priority=self.priority,
+            execution_after=datetime.datetime.fromtimestamp(execution_time),
+            name=f"{self.name}#{self.occurrence_count}",
+        )
+        request.execution_time = execution_time
+        request.recurrence = self
+        self.next_execution_time = execution_time
+        self.occurrence_count += 1
+        return request
+
+    def first_request(self, start_time: float) -> JobRequest:
+        """
+        Create the first occurrence at or after `start_time`.
+        """
+        return self._create_request(self.schedule.next_after(start_time, inclusive=True))
+
+    def next_request(self, request: JobRequest) -> JobRequest | None:
+        """
+        Create the occurrence that follows `request`.
+
+        Returns:
+            JobRequest | None: The next occurrence, or None if the definition is cancelled.
+        """
+        if self.cancelled:
+            return None
+        # the request may have been moved to another provider
+        self.provider = request.provider
+        now = time.time()
+        execution_time = self.schedule.next_after(request.execution_time)
+        if execution_time < now and self.missed_runs == MissedRunPolicy.SKIP:
+            skipped_time = execution_time
+            execution_time = self.schedule.next_after(now)
+            logger.info(
+                f"skip missed runs of {self.name} from "
+                f"{datetime.datetime.fromtimestamp(skipped_time).strftime('%H:%M:%S')}"
+            )
+        if self.frozen:
+            self.next_execution_time = execution_time
+            return None
+        return self._create_request(execution_time)
+
+    def cancel(self) -> None:
+        """
+        Stop creating occurrences, the queued occurrence is still sent.
+        """
+        self.cancelled = True
+
+    def freeze(self) -> None:
+        """
+        Stop creating occurrences but remember when the next one is due.
+        """
+        self.frozen = True
+
+    def to_dict(self) -> dict:
+        """Return the fields of the definition that are needed to create it again."""
+        schedule = self.schedule
+        return {
+            "kind": "recurring_request",
+            "name": self.name,
+            "provider": self.provider.name,
+            "priority": self.priority,
+            "interval": schedule.interval if isinstance(schedule, IntervalSchedule) else None,
+            "start": schedule.start if isinstance(schedule, IntervalSchedule) else None,
+            "cron": schedule.expression if isinstance(schedule, CronSchedule) else None,
+            "missed_runs": str(self.missed_runs),
+            "occurrence_count": self.occurrence_count,
+            "next_execution_time": self.next_execution_time,
+        }
+
+    @classmethod
+    def from_dict(cls, record: dict, provider: ProviderABC) -> "RecurringRequest":
+        """
+        Create a definition from a `to_dict` record, its next occurrence is not created.
+        """
+        if record["cron"] is not None:
+            schedule = CronSchedule(record["cron"])
+        else:
+            schedule = IntervalSchedule(record["interval"], record["start"])
+        recurring_request = cls(
+            schedule=schedule,
+            provider=provider,
+            priority=record["priority"],
+            name=record["name"],
+            missed_runs=MissedRunPolicy(record["missed_runs"]),
+        )
+        recurring_request.occurrence_count = record["occurrence_count"]
+        recurring_request.next_execution_time = record["next_execution_time"]
+        return recurring_request
+
+    def resume_request(self) -> JobRequest:
+        """
+        Create the occurrence at `next_execution_time` after the definition has been restored.
+        """
+        self.frozen = False
+        execution_time = self.next_execution_time
+        now = time.time()
+        if execution_time < now and self.missed_runs == MissedRunPolicy.SKIP:
+            execution_time = self.schedule.next_after(now, inclusive=True)
+        return self._create_request(execution_time)
@@ -0,0 +1,37 @@
+from .abc import JobRequestABC
+
+
+class RequestRegistry:
+    """
+    Index of the queued requests of every provider by their id and name.
+
+    Providers register a request when it is queued and unregister it when it
+    leaves their queues, so lookups never walk the queues.
+    """
+
+    def __init__(self):
+        self.requests: dict[int, JobRequestABC] = {}
+        self.names: dict[str, set[int]] = {}
+
+    def register(self, request: JobRequestABC) -> None:
+        self.requests[request.id] = request
+        self.names.setdefault(request.name, set()).add(request.id)
+
+    def unregister(self, request: JobRequestABC) -> None:
+        # a reprioritised request has been replaced by its copy with the same id
+        if self.requests.get(request.id) is not request:
+            return
+        del self.requests[request.id]
+        ids = self.names[request.name]
+        ids.discard(request.id)
+        if not ids:
+            del self.names[request.name]
+
+    def get(self, request_id: int) -> JobRequestABC | None:
+        return self.requests.get(request_id)
+
+    def find(self, name: str) -> list[JobRequestABC]:
+        return [self.requests[request_id] for request_id in sorted(self.names.get(name, ()))]
+
+    def __len__(self) -> int:
+        return len(self.requests)
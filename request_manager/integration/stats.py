@@ -0,0 +1,156 @@
+import dataclasses
+import math
+import time
+from typing import TYPE_CHECKING, Iterable
+
+if TYPE_CHECKING:
+    from .abc import ProviderABC
+
+
+class WaitHistogram:
+    """
+    Count durations in logarithmic buckets, a record is O(1) and the memory is fixed.
+
+    The bucket `i > 0` counts the durations up to `min_value * growth ** i` seconds,
+    so a percentile is known within a factor of `growth`.
+    """
+
+    def __init__(self, min_value: float = 1e-4, growth: float = 1.25, bucket_count: int = 96):
+        self.min_value = min_value
+        self.growth = growth
+        self.counts = [0] * bucket_count
+        self._log_growth = math.log(growth)
+
+    def record(self, value: float) -> None:
+        if value <= self.min_value:
+            index = 0
+        else:
+            index = math.ceil(math.log(value / self.min_value) / self._log_growth)
+            index = min(index, len(self.counts) - 1)
+        self.counts[index] += 1
+
+    def upper_bound(self, index: int) -> float:
+        """Return the longest duration that is counted by the bucket `index`."""
+        return self.min_value * self.growth**index
+
+    def percentile(self, q: float, since: list[int] | None = None) -> float | None:
+        """
+        Return the upper bound of the `q` percentile, None if nothing has been recorded.
+
+        Args:
+            q (float): The percentile between 0 and 100.
+            since (list[int], optional): The `counts` of an earlier copy, only the durations
+                that have been recorded after it are used.
+        """
+        counts = self.counts
+        if since is not None:
+            counts = [count - old for count, old in zip(counts, since)]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = max(1, math.ceil(total * q / 100))
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return self.upper_bound(index)
+        return self.upper_bound(len(counts) - 1)
+
+
+@dataclasses.dataclass
+class ProviderStats:
+    """The state of a provider in the last interval of a `Monitor`."""
+
+    name: str
+    enabled: bool
+    rate_limit: float
+    effective_rate: float
+    ready: int
+    pending: int
+    in_flight: int
+    wait_p50: float | None
+    wait_p99: float | None
+    error_rate: float | None
+
+
+@dataclasses.dataclass
+class _Sample:
+    time: float
+    sent_count: int
+    error_count: int
+    wait_counts: list[int]
+
+
+class Monitor:
+    """
+    Sample the counters of the providers, the rates and the percentiles are computed
+    between two samples. It reads only counters and queue sizes, never the queues.
+    """
+
+    def __init__(self):
+        self._samples: dict["ProviderABC", _Sample] = {}
+
+    def _take_sample(self, provider: "ProviderABC", now: float) -> _Sample:
+        return _Sample(
+            now, provider.sent_count, provider.error_count, list(provider.queue_wait.counts)
+        )
+
+    def sample(self, providers: Iterable["ProviderABC"]) -> list[ProviderStats]:
+        """
+        Return the stats of each provider since the last call, since the provider has been
+        created on the first call.
+        """
+        now = time.time()
+        stats = []
+        samples = {}
+        for provider in providers:
+            previous = self._samples.get(provider)
+            current = samples[provider] = self._take_sample(provider, now)
+            if previous is None:
+                previous = _Sample(provider.created_time, 0, 0, None)
+            sent = current.sent_count - previous.sent_count
+            errors = current.error_count - previous.error_count
+            elapsed = now - previous.time
+            stats.append(
+                ProviderStats(
+                    name=provider.name,
+                    enabled=provider.enabled.is_set(),
+                    rate_limit=provider.rate_limit,
+                    effective_rate=sent / elapsed if elapsed > 0 else 0.0,
+                    ready=max(0, provider.queue.qsize() - provider.tombstones),
+                    pending=provider.pending_request_queue.qsize(),
+                    in_flight=provider.in_flight,
+                    wait_p50=provider.queue_wait.percentile(50, previous.wait_counts),
+                    wait_p99=provider.queue_wait.percentile(99, previous.wait_counts),
+                    error_rate=errors / (sent + errors) if sent + errors else None,
+                )
+            )
+        # the removed providers are forgotten
+        self._samples = samples
+        return stats
+
+
+def _format_seconds(value: float | None) -> str:
+    if value is None:
+        return "-"
+    if value < 1:
+        return f"{value * 1000:.1f}ms"
+    return f"{value:.2f}s"
+
+
+def format_stats(stats: list[ProviderStats]) -> str:
+    """Render the stats of a `Monitor` as a table, one provider per line."""
+    lines = [
+        f"{'PROVIDER':<16} {'STATE':<8} {'RATE/LIMIT':>15} {'READY':>8} {'PENDING':>8}"
+        f" {'INFLIGHT':>8} {'WAIT P50':>9} {'WAIT P99':>9} {'ERRORS':>7}"
+    ]
+    for row in stats:
+        error_rate = "-" if row.error_rate is None else f"{row.error_rate:.1%}"
+        rate = f"{row.effective_rate:.1f}/{row.rate_limit:g}"
+        lines.append(
+            f"{row.name[:16]:<16} {'enabled' if row.enabled else 'disabled':<8} {rate:>15}"
+            f" {row.ready:>8} {row.pending:>8} {row.in_flight:>8}"
+            f" {_format_seconds(row.wait_p50):>9} {_format_seconds(row.wait_p99):>9}"
+            f" {error_rate:>7}"
+        )
+    return "\n".join(lines)
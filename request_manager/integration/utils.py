@@ -14,13 +14,25 @@ class Response:
     data: dict[str, Any]
 
 
+class MissedRunPolicy(enum.StrEnum):
+    # send the missed occurrences one after another until the schedule is caught up
+    CATCH_UP = "catch_up"
+    # drop the missed occurrences and continue from the next future one
+    SKIP = "skip"
+
+
 class CLIActions(enum.StrEnum):
     WIZARD = "Wizard"
     RUN = "Start providers"
     STOP = "Stop providers"
     SIMULATE_EXAMPLE = "Simulate example"
     ADD_PROVIDER = "Add new provider"
+    REMOVE_PROVIDER = "Remove provider"
+    SET_RATE_LIMIT = "Change provider rate-limit"
     ENABLE_PROVIDER = "Enable provider"
     DISABLE_PROVIDER = "Disable provider"
     ADD_REQUEST = "Add new request"
+    RESTORE_REQUESTS = "Restore saved requests"
+    INSPECT_REQUEST = "Inspect/modify request"
+    MONITOR = "Live monitor"
     EXIT = "Exit program"
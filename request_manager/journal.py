@@ -0,0 +1,63 @@
+import json
+import os
+
+from .integration.abc import JobRequestABC
+from .integration.payload import PayloadArena, PayloadRef, payload_view
+from .integration.recurrence import RecurringRequest
+
+
+def payloads_path(path: str | os.PathLike) -> str:
+    """Return the file that keeps the payloads of the journal `path`."""
+    return os.path.abspath(f"{os.fspath(path)}.payloads")
+
+
+def write_journal(
+    path: str | os.PathLike, requests: list[JobRequestABC | RecurringRequest]
+) -> None:
+    """
+    Persist the requests as json lines, one record per request.
+
+    The bytes and memoryview payloads are written as they are to the payloads file of
+    the journal and the records keep their offsets, a `PayloadRef` keeps its arena.
+
+    Args:
+        path (str | PathLike): The journal file, it is overwritten.
+        requests (list[JobRequest | RecurringRequest]): The requests and the recurring
+            request definitions to persist.
+    """
+    arena_path = payloads_path(path)
+    temporary_path = f"{arena_path}.tmp"
+    arena = None
+    with open(path, "w") as journal:
+        for request in requests:
+            record = request.to_dict()
+            payload = getattr(request, "payload", None)
+            # the old payloads file is replaced, the payloads in it are written again
+            if payload is not None and not (
+                isinstance(payload, PayloadRef) and payload.arena.path != arena_path
+            ):
+                if arena is None:
+                    if os.path.exists(temporary_path):
+                        os.remove(temporary_path)
+                    arena = PayloadArena(temporary_path)
+                ref = arena.append(payload_view(payload))
+                record["payload"] = {**ref.to_dict(), "arena": arena_path}
+            journal.write(json.dumps(record) + "\n")
+    if arena is not None:
+        arena.close()
+        os.replace(temporary_path, arena_path)
+    elif os.path.exists(arena_path):
+        os.remove(arena_path)
+    # the references of the replaced file keep reading it, the new ones read the new file
+    PayloadArena.forget(arena_path)
+
+
+def read_journal(path: str | os.PathLike) -> list[dict]:
+    """
+    Read the records that have been written by `write_journal`.
+
+    Returns:
+        list[dict]: The records of the persisted requests.
+    """
+    with open(path) as journal:
+        return [json.loads(line) for line in journal if line.strip()]
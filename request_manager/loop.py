@@ -0,0 +1,52 @@
+import asyncio
+import os
+from typing import Any, Callable, Coroutine
+
+# the event loops that can be selected by name, uvloop is an optional dependency
+LOOPS = ("asyncio", "uvloop")
+# the loop used when no name is given, e.g. REQUEST_MANAGER_LOOP=uvloop rmcli
+LOOP_ENV = "REQUEST_MANAGER_LOOP"
+
+
+def loop_factory(name: str | None = None) -> Callable[[], asyncio.AbstractEventLoop]:
+    """
+    Return the function that creates an event loop of the selected implementation.
+
+    Args:
+        name (str, optional): "asyncio" or "uvloop". Defaults to the `REQUEST_MANAGER_LOOP`
+            environment variable, or "asyncio" if it is not set.
+
+    Returns:
+        Callable[[], AbstractEventLoop]: The factory of the event loops.
+
+    Raises:
+        ImportError: If uvloop has been selected and it is not installed.
+        ValueError: If the name is not one of `LOOPS`.
+    """
+    if name is None:
+        name = os.environ.get(LOOP_ENV) or "asyncio"
+    if name == "asyncio":
+        return asyncio.new_event_loop
+    if name == "uvloop":
+        try:
+            # imported on demand, the default loop does not need it
+            import uvloop
+        except ImportError as e:
+            raise ImportError("uvloop is not installed, pip install uvloop") from e
+        return uvloop.new_event_loop
+    raise ValueError(f"unknown event loop {name}, use one of {', '.join(LOOPS)}")
+
+
+def run(main: Coroutine[Any, Any, Any], loop: str | None = None) -> Any:
+    """
+    Run a coroutine like `asyncio.run`, in a loop of the selected implementation.
+
+    Args:
+        main (Coroutine): The coroutine that drives the controller.
+        loop (str, optional): The name of the event loop, see `loop_factory`.
+
+    Returns:
+        Any: The result of the coroutine.
+    """
+    with asyncio.Runner(loop_factory=loop_factory(loop)) as runner:
+        return runner.run(main)
@@ -5,4 +5,5 @@ setup(
     version="0.0.1",
     packages=find_packages(),
     install_requires=["questionary==2.0.1"],
+    extras_require={"uvloop": ["uvloop>=0.19"]},
 )
@@ -11,3 +11,8 @@ def provider1():
 @pytest.fixture
 def controller():
     return Controller()
+
+
+@pytest.fixture
+def provider2():
+    return Provider("test_provider2", rate_limit=1.0)
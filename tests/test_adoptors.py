@@ -4,7 +4,7 @@ from unittest.mock import Mock, patch
 
 import pytest
 
-from request_manager import JobRequest, Response, StatusCode
+from request_manager import JobRequest, Provider, Response, StatusCode
 from tests.fixtures import provider1
 
 
@@ -22,6 +22,13 @@ class TestJobRequest:
         assert request.is_ready() is True
 
 
+    def test_is_expired(self, provider1):
+        request = JobRequest(provider1, 1, 0, "test")
+        assert request.is_expired() is False
+        request = JobRequest(provider1, 1, 0, "test", expires_after=-1)
+        assert request.is_expired() is True
+
+
 class TestProvider:
     @pytest.mark.asyncio
     async def test_wait_for_rate_limit(self, provider1):
@@ -45,12 +52,26 @@ class TestProvider:
         request = Mock()
         request.name = "test_request"
         request.is_ready = lambda: True
+        request.finished = False
 
         provider1.pending_request_queue.put_nowait((1, request))
         await provider1.check_pending_request()
         assert provider1.queue.qsize() == 1
         assert provider1.pending_request_queue.qsize() == 0
 
+    @pytest.mark.asyncio
+    async def test_pending_queue_is_ordered_by_execution_time(self, provider1):
+        later = JobRequest(provider1, 10, 60, "later")
+        soon = JobRequest(provider1, 1, 0, "soon")
+        provider1.add_request(later)
+        provider1.add_request(soon)
+        assert provider1.next_pending_time() is None
+        for _ in range(2):
+            await provider1._run_job()
+        # the high priority request that is not ready does not block the ready one
+        assert provider1.next_pending_time() == later.execution_time
+        assert provider1.queue.qsize() == 0
+
     @pytest.mark.asyncio
     async def test_run(self, provider1):
         request = JobRequest(provider1, 1, 0, "test")
@@ -70,3 +91,71 @@ class TestProvider:
         provider1.enabled.set()
         provider1.stop()
         assert not provider1.enabled.is_set()
+
+    @pytest.mark.asyncio
+    async def test_expired_request_is_not_sent(self, provider1):
+        expired = []
+        provider1.on_expired = expired.append
+        request = JobRequest(provider1, 1, 0, "test", expires_after=-1)
+        provider1.add_request(request)
+        with patch.object(provider1, "send_request") as send_request:
+            await provider1._run_job()
+        send_request.assert_not_called()
+        assert expired == [request]
+        assert provider1.expired_count == 1
+        assert provider1.queue.qsize() == 0
+
+    def test_sweep_expired(self, provider1):
+        expired = []
+        provider1.on_expired = expired.append
+        requests = [
+            JobRequest(provider1, 1, 60, f"{i}", expires_after=expires_after)
+            for i, expires_after in enumerate([-2, 30, -1, None])
+        ]
+        for request in requests:
+            provider1.add_request(request)
+        assert provider1.sweep_expired() == 2
+        assert expired == [requests[0], requests[2]]
+        assert len(provider1.expiry_index) == 1
+        assert provider1.drain_requests() == [requests[1], requests[3]]
+
+    def test_compact(self, provider1):
+        provider1.compact_threshold = 2
+        requests = [JobRequest(provider1, 1, 0, f"{i}") for i in range(5)]
+        for request in requests:
+            provider1.add_request(request)
+        assert provider1.drop_request(requests[0]) is True
+        assert provider1.drop_request(requests[0]) is False
+        assert provider1.queue.qsize() == 5
+        provider1.drop_request(requests[1])
+        provider1.drop_request(requests[2])
+        # the dropped requests are the majority, they have been removed
+        assert provider1.queue.qsize() == 2
+        assert provider1.tombstones == 0
+        assert provider1.get_queue_size() == 2
+
+    def test_fair_queueing(self):
+        provider = Provider("fair", rate_limit=1.0, fair_queueing=True)
+        for i in range(6):
+            provider.add_request(JobRequest(provider, i, 0, f"a{i}", tenant="a"))
+        for i in range(3):
+            provider.add_request(JobRequest(provider, i, 0, f"b{i}", tenant="b"))
+        provider.set_tenant_weight("a", 2)
+        names = [provider.queue.get_nowait()[1].name for _ in range(6)]
+        # "a" gets two dispatches per round and each tenant keeps its priority order
+        assert names == ["a5", "a4", "b2", "a3", "a2", "b1"]
+        assert provider.queue.qsize() == 3
+
+    def test_fair_queueing_compact(self):
+        provider = Provider("fair", rate_limit=1.0, fair_queueing=True)
+        provider.compact_threshold = 2
+        requests = [JobRequest(provider, 1, 0, f"{i}", tenant=f"{i % 2}") for i in range(4)]
+        for request in requests:
+            provider.add_request(request)
+        for request in requests[::2]:
+            provider.drop_request(request)
+        provider.drop_request(requests[1])
+        assert provider.queue.qsize() == 1
+        assert provider.tenant_counts == {"1": 1}
+        assert provider.drain_requests() == [requests[3]]
+        assert provider.tenant_counts == {}
@@ -1 +1,8 @@
 # TODO add cli testcases
+from request_manager.cli import validate_rate_limit
+
+
+def test_validate_rate_limit():
+    assert validate_rate_limit("2.5") is True
+    assert validate_rate_limit("0") == "rate limit must be positive"
+    assert validate_rate_limit("fast") == "rate limit must be a number"
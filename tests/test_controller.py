@@ -1,9 +1,14 @@
 import asyncio
+import time
 
 import pytest
 import datetime
 
-from tests.fixtures import controller, provider1
+from unittest.mock import patch
+
+from request_manager import Controller, Provider, Response, StatusCode
+from request_manager.journal import write_journal
+from tests.fixtures import controller, provider1, provider2
 
 
 class TestController:
@@ -79,3 +84,195 @@ class TestController:
         await asyncio.sleep(1)
         assert provider1.queue.qsize() == 0
         controller.stop()
+
+    @pytest.mark.asyncio
+    async def test_add_provider_while_running(self, controller, provider1):
+        controller.start()
+        controller.add_provider(provider1)
+        controller.new_request_received(provider1, 1, 0, "test")
+        await asyncio.sleep(0.1)
+        assert provider1.queue.qsize() == 0
+        controller.stop()
+
+    @pytest.mark.asyncio
+    async def test_set_rate_limit(self, controller, provider1):
+        controller.add_provider(provider1)
+        controller.set_rate_limit("test_provider", 5)
+        assert provider1.rate_limit == 5
+        with pytest.raises(ValueError):
+            controller.set_rate_limit(provider1, 0)
+
+    @pytest.mark.asyncio
+    async def test_remove_provider_migrate_requests(self, controller, provider1, provider2):
+        provider1.set_rate_limit(50)
+        provider2.set_rate_limit(50)
+        controller.add_provider(provider1)
+        controller.add_provider(provider2)
+        sent = []
+
+        async def fake_send_request(request):
+            await asyncio.sleep(0.005)
+            sent.append(request.name)
+            return Response(status_code=StatusCode.SUCCESS, data={"message": "done"})
+
+        with (
+            patch.object(provider1, "send_request", side_effect=fake_send_request),
+            patch.object(provider2, "send_request", side_effect=fake_send_request),
+        ):
+            for i in range(20):
+                controller.new_request_received(provider1, 1, 0, f"{i}")
+            controller.start()
+            await asyncio.sleep(0.1)
+            requests = await controller.remove_provider(provider1, migrate_to=provider2)
+            assert "test_provider" not in controller.providers
+            assert all(request.provider is provider2 for request in requests)
+            with pytest.raises(ValueError):
+                controller.new_request_received(provider1, 1, 0, "late")
+            await controller.wait_for_complete()
+            controller.stop()
+
+        assert sorted(sent, key=int) == [f"{i}" for i in range(20)]
+
+    @pytest.mark.asyncio
+    async def test_drain(self, controller, provider1, tmp_path):
+        provider1.set_rate_limit(50)
+        controller.add_provider(provider1)
+        for i in range(5):
+            controller.new_request_received(provider1, 1, 0, f"due {i}")
+        controller.new_request_received(provider1, 1, 60, "later")
+        controller.start()
+
+        journal_path = tmp_path / "journal.jsonl"
+        remaining = await controller.drain(timeout=5, journal_path=journal_path)
+
+        assert [request.name for request in remaining] == ["later"]
+        assert controller.tasks == []
+        with pytest.raises(RuntimeError):
+            controller.new_request_received(provider1, 1, 0, "rejected")
+
+        new_controller = Controller()
+        new_controller.add_provider(Provider("test_provider", 1))
+        (request,) = new_controller.restore_journal(journal_path)
+        assert request.name == "later"
+        assert request.execution_time == pytest.approx(remaining[0].execution_time, abs=1e-5)
+
+    @pytest.mark.asyncio
+    async def test_drain_deadline(self, controller, provider1):
+        controller.add_provider(provider1)
+        for i in range(5):
+            controller.new_request_received(provider1, 1, 0, f"{i}")
+        controller.start()
+        start = time.time()
+        remaining = await controller.drain(timeout=0.5)
+        assert time.time() - start < 1
+        assert 0 < len(remaining) < 5
+
+    @pytest.mark.asyncio
+    async def test_add_provider_again(self, controller, provider1):
+        controller.add_provider(provider1)
+        with pytest.raises(ValueError):
+            controller.add_provider(Provider("test_provider", 1))
+        controller.start()
+        await controller.remove_provider(provider1)
+        controller.add_provider(provider1)
+        controller.new_request_received(provider1, 1, 0, "test")
+        await asyncio.sleep(0.1)
+        assert provider1.queue.qsize() == 0
+        controller.stop()
+
+    @pytest.mark.asyncio
+    async def test_start_after_drain(self, controller, provider1):
+        controller.add_provider(provider1)
+        controller.start()
+        await controller.drain(timeout=1)
+        controller.start()
+        controller.new_request_received(provider1, 1, 0, "test")
+        await asyncio.sleep(0.1)
+        assert provider1.queue.qsize() == 0
+        controller.stop()
+
+    @pytest.mark.asyncio
+    async def test_submit_from_threads(self, controller, provider1):
+        controller.add_provider(provider1)
+        provider1.stop()
+        with pytest.raises(RuntimeError):
+            controller.submit_threadsafe(provider1)
+        controller.start()
+
+        def produce(thread):
+            futures = [
+                controller.submit_threadsafe(provider1, request_name=f"{thread}-{i}")
+                for i in range(500)
+            ]
+            futures.append(controller.submit_threadsafe("missing"))
+            return futures
+
+        results = await asyncio.gather(*(asyncio.to_thread(produce, thread) for thread in range(4)))
+        futures = [future for result in results for future in result]
+        await asyncio.wait(
+            [asyncio.wrap_future(future) for future in futures], timeout=1
+        )
+        assert provider1.queue.qsize() == 2000
+        assert sum(isinstance(future.exception(), KeyError) for future in futures) == 4
+        with pytest.raises(RuntimeError):
+            controller.submit_blocking(provider1)
+        request = await asyncio.to_thread(controller.submit_blocking, provider1, timeout=1)
+        assert request.provider is provider1
+        future = controller.submit_many_threadsafe(
+            [{"provider": provider1, "request_name": f"batch-{i}"} for i in range(3)]
+        )
+        requests = await asyncio.wrap_future(future)
+        assert [request.name for request in requests] == ["batch-0", "batch-1", "batch-2"]
+        controller.stop()
+
+    @pytest.mark.asyncio
+    async def test_cancel_reprioritize_reschedule(self, controller, provider1):
+        provider1.set_rate_limit(100)
+        controller.add_provider(provider1)
+        low = controller.new_request_received(provider1, 1, 0, "low")
+        high = controller.new_request_received(provider1, 5, 0, "high")
+        cancelled = controller.new_request_received(provider1, 9, 0, "cancelled")
+        later = controller.new_request_received(provider1, 1, 60, "later")
+        assert controller.find_requests("low") == [low]
+        assert controller.get_request(high.id) is high
+
+        controller.cancel_request(cancelled.id)
+        low = controller.reprioritize_request(low, 10)
+        later = controller.reschedule_request(later, 0)
+        assert controller.get_request(low.id) is low
+        assert provider1.get_queue_size() == 3
+        with pytest.raises(KeyError):
+            controller.cancel_request(cancelled)
+
+        sent = []
+
+        async def fake_send_request(request):
+            sent.append(request.name)
+            return Response(status_code=StatusCode.SUCCESS, data={"message": "done"})
+
+        with patch.object(provider1, "send_request", side_effect=fake_send_request):
+            controller.start()
+            await asyncio.wait_for(controller.wait_for_complete(), timeout=2)
+            controller.stop()
+        assert sent == ["low", "high", "later"]
+        assert len(controller.registry) == 0
+
+    @pytest.mark.asyncio
+    async def test_tenant_quota(self, controller, provider1, tmp_path):
+        controller.add_provider(provider1)
+        controller.set_tenant_quota(provider1, "a", 2)
+        first = controller.new_request_received(provider1, 1, 0, "a1", tenant="a")
+        controller.new_request_received(provider1, 1, 0, "a2", tenant="a")
+        controller.new_request_received(provider1, 1, 0, "b1", tenant="b")
+        with pytest.raises(asyncio.QueueFull):
+            controller.new_request_received(provider1, 1, 0, "a3", tenant="a")
+        controller.cancel_request(first)
+        controller.new_request_received(provider1, 1, 0, "a3", tenant="a")
+        with pytest.raises(ValueError):
+            controller.set_tenant_weight(provider1, "a", 2)
+
+        journal_path = tmp_path / "journal.jsonl"
+        write_journal(journal_path, provider1.drain_requests())
+        controller.set_tenant_quota(provider1, "a", None)
+        restored = controller.restore_journal(journal_path)
+        assert sorted(request.tenant for request in restored) == ["a", "a", "b"]
@@ -0,0 +1,114 @@
+import time
+from unittest.mock import patch
+
+import pytest
+
+from request_manager import (
+    DistributedRateLimiter,
+    FileBackend,
+    JobRequest,
+    MemoryBackend,
+    RateLimitServer,
+    ServerBackend,
+)
+from tests.fixtures import provider1
+
+
+async def acquire_many(limiters, count, rate_limit, key="shared", backlog=10):
+    start = time.time()
+    for _ in range(count):
+        for limiter in limiters:
+            await limiter.acquire(key, rate_limit, backlog)
+    return time.time() - start
+
+
+class TestDistributedRateLimiter:
+    @pytest.mark.asyncio
+    async def test_limiters_share_the_rate_limit(self):
+        backend = MemoryBackend()
+        limiters = [DistributedRateLimiter(backend, lease_size=2) for _ in range(2)]
+        # 10 requests at 20 r/s are at least 9 intervals apart
+        elapsed = await acquire_many(limiters, 5, 20)
+        assert elapsed >= 0.44
+
+    @pytest.mark.asyncio
+    async def test_lease_is_batched(self):
+        backend = MemoryBackend()
+        limiter = DistributedRateLimiter(backend, lease_size=5, lease_duration=1)
+        with patch.object(backend, "reserve", wraps=backend.reserve) as reserve:
+            await acquire_many([limiter], 10, 100)
+        assert reserve.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_lease_is_sized_by_backlog(self):
+        limiter = DistributedRateLimiter(MemoryBackend(), lease_size=5, lease_duration=1)
+        await limiter.acquire("shared", 100, backlog=1)
+        assert "shared" in limiter.leases
+        assert len(limiter.leases["shared"].slots) == 0
+        await limiter.acquire("shared", 100, backlog=3)
+        assert len(limiter.leases["shared"].slots) == 2
+
+    @pytest.mark.asyncio
+    async def test_release_unused_slots(self):
+        backend = MemoryBackend()
+        limiter = DistributedRateLimiter(backend, lease_size=5, lease_duration=1)
+        await limiter.acquire("shared", 10, backlog=5)
+        assert backend.next_slots["shared"] == pytest.approx(time.time() + 0.5, abs=0.05)
+        await limiter.release("shared")
+        assert backend.next_slots["shared"] == pytest.approx(time.time() + 0.1, abs=0.05)
+        assert "shared" not in limiter.leases
+
+    @pytest.mark.asyncio
+    async def test_rate_change_drops_the_lease(self):
+        backend = MemoryBackend()
+        limiter = DistributedRateLimiter(backend, lease_size=5, lease_duration=1)
+        await limiter.acquire("shared", 100, backlog=5)
+        await limiter.acquire("shared", 50, backlog=5)
+        lease = limiter.leases["shared"]
+        assert lease.rate_limit == 50
+        assert len(lease.slots) == 4
+        # the unused slots of the first lease have been given back
+        assert backend.next_slots["shared"] == lease.end
+
+    @pytest.mark.asyncio
+    async def test_file_backend(self, tmp_path):
+        path = tmp_path / "rate_limit.json"
+        limiters = [DistributedRateLimiter(FileBackend(path), lease_size=1) for _ in range(2)]
+        elapsed = await acquire_many(limiters, 3, 20)
+        assert elapsed >= 0.24
+        assert "shared" in path.read_text()
+
+    @pytest.mark.asyncio
+    async def test_server_backend(self):
+        server = RateLimitServer()
+        await server.start()
+        backends = [ServerBackend(server.host, server.port) for _ in range(2)]
+        try:
+            limiters = [DistributedRateLimiter(backend, lease_size=2) for backend in backends]
+            elapsed = await acquire_many(limiters, 3, 20, key="my provider")
+            assert elapsed >= 0.24
+            await limiters[0].release("my provider")
+        finally:
+            for backend in backends:
+                await backend.close()
+            await server.close()
+
+    @pytest.mark.asyncio
+    async def test_provider_use_rate_limiter(self, provider1):
+        provider1.rate_limiter = DistributedRateLimiter(MemoryBackend())
+        provider1.queue.put_nowait((1, JobRequest(provider1, 1, 0, "test")))
+        with patch.object(
+            provider1.rate_limiter, "acquire", wraps=provider1.rate_limiter.acquire
+        ) as acquire:
+            await provider1._run_job()
+        acquire.assert_called_once_with(provider1.name, provider1.rate_limit, backlog=1)
+        assert provider1.queue.qsize() == 0
+
+    @pytest.mark.asyncio
+    async def test_provider_keeps_request_when_backend_fails(self, provider1):
+        provider1.rate_limiter = DistributedRateLimiter(ServerBackend("127.0.0.1", 1))
+        request = JobRequest(provider1, 1, 0, "test")
+        provider1.queue.put_nowait((1, request))
+        with patch("request_manager.integration.adaptor.RATE_LIMITER_RETRY_DELAY", 0):
+            await provider1._run_job()
+        assert provider1.queue.get_nowait()[1] is request
@@ -0,0 +1,42 @@
+import asyncio
+import importlib.util
+import subprocess
+import sys
+
+import pytest
+
+from request_manager import loop_factory, run
+
+
+async def current_loop() -> asyncio.AbstractEventLoop:
+    return asyncio.get_running_loop()
+
+
+class TestLoop:
+    def test_default_loop(self, monkeypatch):
+        monkeypatch.delenv("REQUEST_MANAGER_LOOP", raising=False)
+        assert loop_factory() is asyncio.new_event_loop
+        assert isinstance(run(current_loop()), asyncio.BaseEventLoop)
+
+    def test_unknown_loop(self, monkeypatch):
+        monkeypatch.setenv("REQUEST_MANAGER_LOOP", "trio")
+        with pytest.raises(ValueError):
+            loop_factory()
+
+    @pytest.mark.skipif(importlib.util.find_spec("uvloop") is None, reason="uvloop is not installed")
+    def test_uvloop(self):
+        import uvloop
+
+        assert isinstance(run(current_loop(), loop="uvloop"), uvloop.Loop)
+
+    @pytest.mark.skipif(importlib.util.find_spec("uvloop") is not None, reason="uvloop is installed")
+    def test_uvloop_is_not_installed(self):
+        with pytest.raises(ImportError):
+            loop_factory("uvloop")
+
+    def test_library_does_not_import_the_cli_dependencies(self):
+        statement = (
+            "import sys, request_manager;"
+            "assert 'questionary' not in sys.modules and 'prompt_toolkit' not in sys.modules"
+        )
+        subprocess.run([sys.executable, "-c", statement], check=True)
@@ -0,0 +1,76 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from request_manager import (
+    JobRequest,
+    PayloadArena,
+    PayloadRef,
+    Response,
+    StatusCode,
+    payload_view,
+)
+from request_manager.journal import payloads_path, write_journal
+from tests.fixtures import controller, provider1
+
+
+class TestPayload:
+    def test_arena(self, tmp_path):
+        arena = PayloadArena(tmp_path / "arena")
+        first = arena.append(b"first")
+        second = arena.append(memoryview(b"-second-")[1:-1])
+        assert bytes(first.view()) == b"first"
+        assert bytes(second.view()) == b"second"
+        assert len(second) == 6
+        assert PayloadRef.from_dict(second.to_dict()) == second
+        assert PayloadArena.open(tmp_path / "arena") is arena
+
+    def test_payload_is_not_copied(self, provider1):
+        body = bytearray(b"body")
+        request = JobRequest(provider1, 1, 0, "test", payload=memoryview(body))
+        body[0:1] = b"B"
+        assert bytes(request.payload_view()) == b"Body"
+        assert payload_view(b"body").obj == b"body"
+        assert JobRequest(provider1, 1, 0, "test").payload_view() is None
+
+    @pytest.mark.asyncio
+    async def test_journal_payloads(self, controller, provider1, tmp_path):
+        provider1.set_rate_limit(100)
+        controller.add_provider(provider1)
+        arena = PayloadArena(tmp_path / "arena")
+        ref = arena.append(b"in the arena")
+        controller.new_request_received(provider1, 3, 0, "ref", payload=ref)
+        controller.new_request_received(provider1, 2, 0, "bytes", payload=b"inline")
+        controller.new_request_received(provider1, 1, 0, "empty")
+        journal_path = tmp_path / "journal.jsonl"
+        await controller.drain(timeout=0, journal_path=journal_path)
+
+        controller.start()
+        controller.stop()
+        restored = controller.restore_journal(journal_path)
+        assert restored[0].payload == ref
+        assert restored[1].payload.arena.path == payloads_path(journal_path)
+        assert restored[2].payload is None
+
+        # the journal is written again while its payloads file is in use
+        write_journal(journal_path, provider1.drain_requests())
+        for request in restored:
+            provider1.add_request(request)
+        restored_again = controller.restore_journal(journal_path)
+        assert bytes(restored[1].payload_view()) == b"inline"
+        assert bytes(restored_again[1].payload_view()) == b"inline"
+
+        sent = []
+
+        async def fake_send_request(request):
+            sent.append(request.payload_view() and bytes(request.payload_view()))
+            return Response(status_code=StatusCode.SUCCESS, data={"message": "done"})
+
+        with patch.object(provider1, "send_request", side_effect=fake_send_request):
+            controller.start()
+            await asyncio.wait_for(controller.wait_for_complete(), timeout=2)
+            controller.stop()
+        assert sorted(sent, key=str) == sorted(
+            [b"in the arena", b"inline", None] * 2, key=str
+        )
@@ -0,0 +1,143 @@
+import asyncio
+import datetime
+import time
+from unittest.mock import patch
+
+import pytest
+
+from request_manager import (
+    Controller,
+    CronSchedule,
+    IntervalSchedule,
+    MissedRunPolicy,
+    Provider,
+    RecurringRequest,
+    Response,
+    StatusCode,
+)
+from tests.fixtures import controller, provider1
+
+
+def timestamp(*args) -> float:
+    return datetime.datetime(*args).timestamp()
+
+
+class TestSchedule:
+    def test_interval(self):
+        schedule = IntervalSchedule(10, start=100)
+        assert schedule.next_after(50) == 100
+        assert schedule.next_after(100) == 110
+        assert schedule.next_after(100, inclusive=True) == 100
+        assert schedule.next_after(125) == 130
+
+    def test_cron_every_15_minutes(self):
+        schedule = CronSchedule("*/15 * * * *")
+        assert schedule.next_after(timestamp(2024, 1, 1, 10, 7)) == timestamp(2024, 1, 1, 10, 15)
+        assert schedule.next_after(timestamp(2024, 1, 1, 10, 45)) == timestamp(2024, 1, 1, 11, 0)
+        assert schedule.next_after(timestamp(2024, 1, 1, 10, 45), inclusive=True) == timestamp(
+            2024, 1, 1, 10, 45
+        )
+
+    def test_cron_day_and_month(self):
+        # 2024-01-01 is a monday
+        schedule = CronSchedule("30 9 * * 1-5")
+        assert schedule.next_after(timestamp(2024, 1, 5, 10)) == timestamp(2024, 1, 8, 9, 30)
+        schedule = CronSchedule("0 0 29 2 *")
+        assert schedule.next_after(timestamp(2023, 3, 1)) == timestamp(2024, 2, 29)
+        # both day fields are restricted, either of them matches
+        schedule = CronSchedule("0 0 15 * 0")
+        assert schedule.next_after(timestamp(2024, 1, 1)) == timestamp(2024, 1, 7)
+
+    def test_cron_invalid(self):
+        with pytest.raises(ValueError):
+            CronSchedule("* * *")
+        with pytest.raises(ValueError):
+            CronSchedule("61 * * * *")
+        with pytest.raises(ValueError):
+            CronSchedule("0 0 31 2 *").next_after(0)
+
+
+class TestRecurringRequest:
+    def test_missed_runs(self, provider1):
+        now = time.time()
+        schedule = IntervalSchedule(10, start=now - 100)
+        catch_up = RecurringRequest(schedule, provider1, missed_runs=MissedRunPolicy.CATCH_UP)
+        request = catch_up.first_request(now - 100)
+        assert catch_up.next_request(request).execution_time == now - 90
+
+        skip = RecurringRequest(schedule, provider1, missed_runs=MissedRunPolicy.SKIP)
+        request = skip.first_request(now - 100)
+        assert skip.next_request(request).execution_time == pytest.approx(now, abs=10)
+
+    def test_cancel(self, provider1):
+        recurring_request = RecurringRequest(IntervalSchedule(10, 0), provider1)
+        request = recurring_request.first_request(0)
+        recurring_request.cancel()
+        assert recurring_request.next_request(request) is None
+
+    @pytest.mark.asyncio
+    async def test_only_next_occurrence_is_queued(self, controller, provider1):
+        provider1.set_rate_limit(100)
+        controller.add_provider(provider1)
+        sent = []
+
+        async def fake_send_request(request):
+            sent.append(request.name)
+            return Response(status_code=StatusCode.SUCCESS, data={"message": "done"})
+
+        with patch.object(provider1, "send_request", side_effect=fake_send_request):
+            recurring_request = controller.new_recurring_request(
+                provider1, interval=0.1, request_name="poll"
+            )
+            controller.start()
+            await asyncio.wait_for(asyncio.sleep(0.35), timeout=1)
+            assert provider1.get_queue_size() == 1
+            recurring_request.cancel()
+            await asyncio.wait_for(asyncio.sleep(0.15), timeout=1)
+            controller.stop()
+
+        assert sent[:3] == ["poll#0", "poll#1", "poll#2"]
+        assert provider1.get_queue_size() == 0
+
+    @pytest.mark.asyncio
+    async def test_pending_occurrence_does_not_block_the_loop(self, controller, provider1):
+        controller.add_provider(provider1)
+        controller.new_recurring_request(provider1, interval=2, start_after=1)
+        controller.start()
+        start = time.time()
+        await asyncio.sleep(0.05)
+        assert time.time() - start < 0.5
+        controller.stop()
+
+    @pytest.mark.asyncio
+    async def test_drain_persists_definition(self, controller, provider1, tmp_path):
+        provider1.set_rate_limit(100)
+        controller.add_provider(provider1)
+        controller.new_recurring_request(
+            provider1, interval=0.05, request_name="poll", missed_runs=MissedRunPolicy.CATCH_UP
+        )
+        controller.start()
+        await asyncio.sleep(0.1)
+        journal_path = tmp_path / "journal.jsonl"
+        start = time.time()
+        await controller.drain(timeout=0.3, journal_path=journal_path)
+        # the drain doesn't keep sending new occurrences until the deadline
+        assert time.time() - start < 0.25
+        assert provider1.get_queue_size() == 0
+
+        new_controller = Controller()
+        new_provider = Provider("test_provider", 1)
+        new_controller.add_provider(new_provider)
+        (request,) = new_controller.restore_journal(journal_path)
+        (recurring_request,) = new_controller.recurring_requests
+        assert request.recurrence is recurring_request
+        assert recurring_request.schedule.interval == 0.05
+        assert recurring_request.missed_runs == MissedRunPolicy.CATCH_UP
+        assert request.name == f"poll#{recurring_request.occurrence_count - 1}"
+        assert new_provider.get_queue_size() == 1
+
+    def test_interval_or_cron(self, controller, provider1):
+        with pytest.raises(ValueError):
+            controller.new_recurring_request(provider1)
+        with pytest.raises(ValueError):
+            controller.new_recurring_request(provider1, interval=1, cron="* * * * *")
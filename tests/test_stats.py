@@ -0,0 +1,51 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+
+from request_manager import Response, StatusCode
+from request_manager.integration.stats import Monitor, WaitHistogram, format_stats
+from tests.fixtures import controller, provider1
+
+
+class TestStats:
+    def test_wait_histogram(self):
+        histogram = WaitHistogram(min_value=0.001, growth=2)
+        for value in [0.0005] * 50 + [0.003] * 49 + [1]:
+            histogram.record(value)
+        assert histogram.percentile(50) == 0.001
+        assert histogram.percentile(99) == 0.004
+        assert histogram.percentile(100) == 1.024
+        since = list(histogram.counts)
+        assert histogram.percentile(50, since) is None
+        histogram.record(0.1)
+        assert histogram.percentile(50, since) == 0.128
+
+    @pytest.mark.asyncio
+    async def test_monitor(self, controller, provider1):
+        provider1.set_rate_limit(100)
+        controller.add_provider(provider1)
+        for i in range(4):
+            controller.new_request_received(provider1, 1, 0, f"{i}")
+        controller.new_request_received(provider1, 1, 60, "later")
+        monitor = Monitor()
+        [stats] = monitor.sample(controller.providers)
+        # the run loop has not moved the later request to the pending queue yet
+        assert (stats.ready, stats.pending, stats.in_flight) == (5, 0, 0)
+        assert stats.wait_p50 is None
+
+        results = iter([StatusCode.FAILED] + [StatusCode.SUCCESS] * 4)
+
+        async def fake_send_request(request):
+            return Response(status_code=next(results), data={})
+
+        with patch.object(provider1, "send_request", side_effect=fake_send_request):
+            controller.start()
+            await asyncio.wait_for(provider1.queue.join(), timeout=2)
+            controller.stop()
+        [stats] = monitor.sample(controller.providers)
+        assert (stats.ready, stats.pending) == (0, 1)
+        assert stats.error_rate == pytest.approx(0.2)
+        assert stats.effective_rate > 0
+        assert stats.wait_p50 is not None
+        assert "test_provider" in format_stats([stats])